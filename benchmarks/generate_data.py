@@ -0,0 +1,206 @@
+#!/usr/bin/python3
+
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+# Generate a synthetic forum: a messages file with the fields named in
+# config.json, a list of names for each pseudonym, a CSV class list, and the
+# true names with the number of times each one was used in the messages
+
+import argparse
+import csv
+import os
+import random
+import sys
+
+from datetime import datetime, timedelta
+
+# import the nicknames scripts from the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from constants import (CSV_NAME_LABEL, CSV_PSEUDONYM_LABEL, PARENT_FIELD_NAME, POST_FIELD_NAME, SESSION_FIELD_NAME,
+                       TEXT_FIELD_NAME, TIME_FIELD_NAME, TOPIC_FIELD_NAME, USER_FIELD_NAME, USER_ID_FIELD_NAME)
+from names import create_counter, write_names
+
+# the files written to the output directory
+MESSAGES_FILE = 'messages.csv'
+NAMES_FILE = 'names.txt'
+CLASS_LIST_FILE = 'students.csv'
+TRUE_NAMES_FILE = 'true_names.txt'
+
+MESSAGE_FIELDS = [
+    POST_FIELD_NAME, PARENT_FIELD_NAME, USER_ID_FIELD_NAME, USER_FIELD_NAME,
+    SESSION_FIELD_NAME, TOPIC_FIELD_NAME, TIME_FIELD_NAME, TEXT_FIELD_NAME,
+]
+
+FIRST_NAMES = [
+    'Alex', 'Ann', 'Anna', 'Ben', 'Bob', 'Chris', 'Dana', 'Ella', 'Finn', 'Grace', 'Hana', 'Ivan', 'Jo',
+    'Jo Ann', 'Kim', 'Lee', 'Maria', 'Mary-Jane', 'Nina', 'Omar', 'Priya', 'Rosa', 'Sam', 'Tom', 'Wei', 'Zoe',
+]
+LAST_NAMES = ['Brown', 'Garcia', 'Jones', 'Khan', 'Lee', 'Murphy', 'Nowak', 'Patel', 'Silva', 'Smith', 'Taylor', 'Wilson']
+NICKNAMES = {'Alex': 'Al', 'Ben': 'Benny', 'Bob': 'Bobby', 'Chris': 'Kit', 'Maria': 'Mia', 'Mary-Jane': 'MJ', 'Sam': 'Sammy', 'Tom': 'Tommy'}
+# parts for making up more family names, so that large classes have few duplicates
+SYLLABLES = ['ba', 'den', 'ko', 'la', 'mi', 'nor', 'ra', 'sen', 'ta', 'vel', 'wi', 'zu']
+
+GREETINGS = ['Hi', 'hi', 'Hello', 'Hey', 'Dear']
+SIGN_OFFS = ['Thanks', 'Cheers', 'Best wishes', 'See you']
+SENTENCES = [
+    'I agree with the points made in the reading this week.',
+    'Could you say a bit more about what you meant?',
+    'That is a really interesting way to look at it.',
+    'I was not sure about the second question either.',
+    'The lecture slides cover this in more detail.',
+    'I think the example in the paper shows this well.',
+    'Has anyone found a good source for the assignment?',
+    'My group had a similar discussion yesterday.',
+]
+
+# the share of posts that reply to an earlier post in the same topic
+REPLY_RATE = 0.8
+# replies are to one of the most recent posts in the topic
+RECENT_POSTS = 10
+
+# make up a family name from a few syllables
+def make_family_name(rng):
+    return ''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize()
+
+# a misspelling of the name, swapping two letters after the first
+def misspell(name, rng):
+    if len(name) < 4:
+        return name + name[-1]
+    idx = rng.randrange(1, len(name) - 2)
+    return name[:idx] + name[idx+1] + name[idx] + name[idx+2:]
+
+# the ways of referring to a user, most formal first
+def make_name_variants(rng):
+    first = rng.choice(FIRST_NAMES)
+    last = rng.choice(LAST_NAMES) if rng.random() < 0.5 else make_family_name(rng)
+    nickname = NICKNAMES.get(first, first.split()[0][:3])
+    variants = [f'{first} {last}', first, last, nickname, misspell(first, rng), f'{first} {last[0]}']
+    # a short name may be the same as another variant
+    return list(dict.fromkeys(variants))
+
+# The generated forum, with every name used counted as it is written
+class Forum:
+
+    def __init__(self, *, users, sessions, seed):
+        self.rng = random.Random(seed)
+        rng = self.rng
+        # pseudonyms are numbers, as in the real data, but not in the same order as the users
+        self.pseudonyms = [str(p) for p in rng.sample(range(10000, 10000 + 10 * users), users)]
+        self.user_ids = list(range(1, users + 1))
+        self.variants = [make_name_variants(rng) for _ in range(users)]
+        # every session has some users, and some users take part in two sessions
+        self.session_users = [[] for _ in range(sessions)]
+        for user in range(users):
+            self.session_users[user % sessions].append(user)
+            if rng.random() < 0.2:
+                self.session_users[rng.randrange(sessions)].append(user)
+        self.true_names = create_counter()
+
+    # pick a way of referring to the user, and count it
+    def mention(self, user, variants=None):
+        name = self.rng.choice(variants or self.variants[user])
+        self.true_names[self.pseudonyms[user]][name] += 1
+        return name
+
+    def make_text(self, user, parent_user, session, *, greeting_rate, signature_rate, mention_rate):
+        rng = self.rng
+        parts = []
+        if parent_user is not None and rng.random() < greeting_rate:
+            # greet the author of the parent post by a short name
+            parts.append(f'{rng.choice(GREETINGS)} {self.mention(parent_user, self.variants[parent_user][1:4])},')
+        for _ in range(rng.randint(1, 3)):
+            parts.append(rng.choice(SENTENCES))
+            if rng.random() < mention_rate:
+                other = rng.choice(self.session_users[session])
+                parts.append(f'As {self.mention(other)} said, it depends on the context.')
+        if rng.random() < signature_rate:
+            parts.append(f'{rng.choice(SIGN_OFFS)}\n{self.mention(user, self.variants[user][:2])}')
+        return ' '.join(parts)
+
+# add the kinds of untidiness that clean_data removes
+def add_noise(text, rng):
+    choice = rng.randrange(4)
+    if choice == 0:
+        return f'"{text}"'
+    if choice == 1:
+        return text.replace(' ', '  ', 2)
+    if choice == 2:
+        return f' {text}\t'
+    return text.replace('it ', '""it"" ', 1)
+
+# generate the messages in time order, returning the forum with the names used
+def generate_messages(*, posts, users, sessions, topics, greeting_rate=0.5, signature_rate=0.5, mention_rate=0.1, noise_rate=0.1, seed=1):
+    forum = Forum(users=users, sessions=sessions, seed=seed)
+    rng = forum.rng
+    # the recent posts in each topic, as (post ID, user) pairs
+    recent = [[] for _ in range(topics)]
+    time = datetime(2022, 1, 1)
+    messages = []
+    for post_id in range(1, posts + 1):
+        topic = rng.randrange(topics)
+        session = topic % sessions
+        user = rng.choice(forum.session_users[session])
+        parent_id, parent_user = 0, None
+        if recent[topic] and rng.random() < REPLY_RATE:
+            parent_id, parent_user = rng.choice(recent[topic])
+        recent[topic] = recent[topic][-RECENT_POSTS+1:] + [(post_id, user)]
+        text = forum.make_text(user, parent_user, session, greeting_rate=greeting_rate, signature_rate=signature_rate, mention_rate=mention_rate)
+        if rng.random() < noise_rate:
+            text = add_noise(text, rng)
+        time += timedelta(minutes=rng.randint(1, 30))
+        messages.append([post_id, parent_id, forum.user_ids[user], forum.pseudonyms[user], session + 1, topic + 1, time.strftime('%Y-%m-%d %H:%M'), text])
+    return forum, messages
+
+# generate the data and write all the files to the output directory
+def write_data(output_dir, *, names_per_user=3, **kwargs):
+    forum, messages = generate_messages(**kwargs)
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, MESSAGES_FILE), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(MESSAGE_FIELDS)
+        writer.writerows(messages)
+    # the list of names to look for has the first few variants for each user
+    names = create_counter()
+    for pseudonym, variants in zip(forum.pseudonyms, forum.variants):
+        names[pseudonym].update(variants[:names_per_user])
+    write_names(os.path.join(output_dir, NAMES_FILE), names)
+    with open(os.path.join(output_dir, CLASS_LIST_FILE), 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([CSV_PSEUDONYM_LABEL, CSV_NAME_LABEL])
+        writer.writerows([pseudonym, variants[0]] for pseudonym, variants in zip(forum.pseudonyms, forum.variants))
+    write_names(os.path.join(output_dir, TRUE_NAMES_FILE), forum.true_names, by_frequency=True, with_counts=True)
+    return len(messages)
+
+# the options that control the content of the messages, shared with run_benchmarks.py
+def add_content_arguments(parser):
+    parser.add_argument('--greeting-rate', type=float, default=0.5, help='Share of replies that start by greeting the parent author')
+    parser.add_argument('--signature-rate', type=float, default=0.5, help='Share of posts that end with the author\'s name')
+    parser.add_argument('--mention-rate', type=float, default=0.1, help='Chance of mentioning another user after each sentence')
+    parser.add_argument('--noise-rate', type=float, default=0.1, help='Share of posts with extra quotes or white space')
+    parser.add_argument('--names-per-user', type=int, default=3, help='Number of names for each user in the names list (at most 6)')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+
+def get_content_options(args):
+    return {
+        'greeting_rate': args.greeting_rate, 'signature_rate': args.signature_rate, 'mention_rate': args.mention_rate,
+        'noise_rate': args.noise_rate, 'names_per_user': args.names_per_user, 'seed': args.seed,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic forum messages and names for benchmarking')
+    parser.add_argument('output_dir', help='Output directory')
+    parser.add_argument('--posts', type=int, default=10000, help='Number of posts')
+    parser.add_argument('--users', type=int, default=250, help='Number of users')
+    parser.add_argument('--sessions', type=int, default=5, help='Number of sessions')
+    parser.add_argument('--topics', type=int, default=500, help='Number of topics, shared between the sessions')
+    add_content_arguments(parser)
+    args = parser.parse_args()
+
+    if args.topics < args.sessions or args.users < args.sessions:
+        parser.error('there must be at least one topic and one user in each session')
+    write_data(args.output_dir, posts=args.posts, users=args.users, sessions=args.sessions, topics=args.topics, **get_content_options(args))
+
+if __name__ == '__main__':
+    # execute only if run as a script
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/python3
+
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+# Time replace_names --by topic as the number of topics grows, with a fixed
+# number of messages per topic: the time per topic should stay roughly flat
+
+import argparse
+import contextlib
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+# import the nicknames scripts from the parent directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from constants import SESSION_FIELD_NAME, TEXT_FIELD_NAME, TOPIC_FIELD_NAME, USER_FIELD_NAME
+from names import create_counter
+from replace_names import GROUP_BY_TOPIC, replace_names
+
+FIRST_NAMES = ['Alex', 'Ann', 'Bob', 'Chris', 'Jo', 'Kim', 'Lee', 'Mary-Jane', 'Sam', 'Tom']
+LAST_NAMES = ['Brown', 'Jones', 'Smith', 'Taylor', 'Wilson']
+
+# make a mapping from pseudonyms to names
+def make_names(n_users, rng):
+    names = create_counter()
+    for user in range(n_users):
+        first = rng.choice(FIRST_NAMES)
+        last = rng.choice(LAST_NAMES)
+        names[str(user)].update([first, last, f'{first} {last}'])
+    return names
+
+# make messages spread evenly across the topics
+def make_messages(n_topics, per_topic, n_users, names, rng):
+    rows = []
+    for topic in range(n_topics):
+        for _ in range(per_topic):
+            user = rng.randrange(n_users)
+            to_name = rng.choice(list(names[str(rng.randrange(n_users))]))
+            from_name = rng.choice(list(names[str(user)]))
+            text = f'Hi {to_name}, thanks for the post. I agree with what you said. {from_name}'
+            rows.append({SESSION_FIELD_NAME: 1, TOPIC_FIELD_NAME: topic, USER_FIELD_NAME: user, TEXT_FIELD_NAME: text})
+    return pd.DataFrame(rows)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time replacing names by topic for increasing numbers of topics')
+    parser.add_argument('--topics', type=int, nargs='+', default=[250, 500, 1000, 2000, 4000], help='Numbers of topics to try')
+    parser.add_argument('--per-topic', type=int, default=10, help='Number of messages in each topic')
+    parser.add_argument('--users', type=int, default=200, help='Number of users')
+    parser.add_argument('--seed', type=int, default=1, help='Random seed')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    names = make_names(args.users, rng)
+    print('topics\trows\tseconds\tms/topic')
+    for n_topics in args.topics:
+        df = make_messages(n_topics, args.per_topic, args.users, names, rng)
+        start = time.perf_counter()
+        # ignore the warnings about duplicate names
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stderr(devnull):
+            replace_names(df, names, group_by=GROUP_BY_TOPIC)
+        seconds = time.perf_counter() - start
+        print(f'{n_topics}\t{len(df)}\t{seconds:.3f}\t{1000*seconds/n_topics:.3f}')
+
+if __name__ == '__main__':
+    # execute only if run as a script
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/python3
+
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+# Time how long it takes to import each of the nicknames scripts, using
+# python -X importtime, and report which slow libraries each one loads
+
+import argparse
+import os
+import subprocess
+import sys
+
+# the scripts are in the parent directory
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+
+MODULES = [
+    'clean_data', 'combine_names', 'compare_names', 'filter_names', 'find_names', 'generate_columns',
+    'metrics', 'names', 'plot_names', 'prepare', 'replace_names', 'sort_data', 'split_names', 'textwash_server',
+]
+
+# libraries that take a noticeable time to import
+SLOW_MODULES = ['matplotlib', 'numpy', 'pandas', 'pyarrow', 'seaborn', 'torch']
+
+# scripts that only work with names files, which should not need any of them
+NAMES_ONLY_MODULES = ['combine_names', 'compare_names', 'metrics', 'names', 'plot_names', 'split_names', 'textwash_server']
+
+# return the total import time in seconds and the slow libraries loaded
+def time_import(module):
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+                            cwd=SCRIPT_DIR, capture_output=True, text=True, check=True)
+    seconds = 0
+    loaded = set()
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line[len('import time:'):].split('|')
+        name = fields[2].strip()
+        if name in SLOW_MODULES:
+            loaded.add(name)
+        elif name == module:
+            seconds = int(fields[1]) / 1e6
+    return seconds, sorted(loaded)
+
+def main():
+    parser = argparse.ArgumentParser(description='Time importing each of the scripts')
+    parser.add_argument('modules', nargs='*', default=MODULES, help='Scripts to import (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to import each script, keeping the fastest')
+    parser.add_argument('--check', help='Fail if a script for names files loads a slow library', action='store_true')
+    args = parser.parse_args()
+
+    failed = []
+    print('module\tseconds\tloaded')
+    for module in args.modules:
+        timings = [time_import(module) for _ in range(args.repeat)]
+        seconds = min(seconds for seconds, _ in timings)
+        loaded = timings[0][1]
+        print(f'{module}\t{seconds:.3f}\t{",".join(loaded) or "-"}')
+        if loaded and module in NAMES_ONLY_MODULES:
+            failed.append(module)
+    if args.check and failed:
+        sys.exit(f'ERROR: slow libraries imported by {", ".join(failed)}')
+
+if __name__ == '__main__':
+    # execute only if run as a script
+    main()
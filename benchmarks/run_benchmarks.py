@@ -0,0 +1,150 @@
+#!/usr/bin/python3
+
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+# Time the main nicknames scripts on synthetic data at several scales, and
+# write the results as JSON so that runs can be compared. Each script is run
+# in a separate process with --metrics-json, so the time and memory of each
+# stage is recorded as well as the total.
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+# import the nicknames scripts from the parent directory
+SCRIPT_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, SCRIPT_DIR)
+
+from benchmarks.generate_data import MESSAGES_FILE, NAMES_FILE, TRUE_NAMES_FILE, add_content_arguments, get_content_options, write_data
+
+# each benchmark runs one script in the data directory, using the files made by the ones before it
+BENCHMARKS = [
+    ('clean_data', 'clean_data.py', [MESSAGES_FILE, 'messages_clean.csv']),
+    ('sort_data', 'sort_data.py', ['messages_clean.csv', 'messages_sorted.csv']),
+    ('generate_columns', 'generate_columns.py', ['messages_sorted.csv', 'messages_plus.csv']),
+    ('find_names', 'find_names.py', ['messages_plus.csv', 'names_regex.txt', '-c', '-q']),
+    ('filter_names', 'filter_names.py', ['messages_plus.csv', NAMES_FILE, 'names_used.txt']),
+    ('replace_names_none', 'replace_names.py', ['messages_plus.csv', 'names_used.txt', 'redacted_none.csv', '--by', 'none', '--used-names', 'replacements_none.txt', '-c', '-q']),
+    ('replace_names_session', 'replace_names.py', ['messages_plus.csv', 'names_used.txt', 'redacted_session.csv', '--by', 'session', '--used-names', 'replacements_session.txt', '-c', '-q']),
+    ('replace_names_topic', 'replace_names.py', ['messages_plus.csv', 'names_used.txt', 'redacted_topic.csv', '--by', 'topic', '--used-names', 'replacements_topic.txt', '-c', '-q']),
+    ('compare_names', 'compare_names.py', [TRUE_NAMES_FILE, 'names_regex.txt', 'names_used.txt', 'replacements_session.txt', '--table', '-o', 'compare.csv']),
+]
+BENCHMARK_NAMES = [name for name, _, _ in BENCHMARKS]
+
+# the number of posts in the smallest to largest data sets
+DEFAULT_SCALES = [1000, 10000, 100000]
+
+# the sizes of the other parts of the data set, relative to the number of posts
+def get_data_sizes(posts, args):
+    sessions = max(1, round(posts / args.posts_per_session))
+    users = max(sessions, round(posts / args.posts_per_user))
+    topics = max(sessions, round(posts / args.posts_per_topic))
+    return {'posts': posts, 'users': users, 'sessions': sessions, 'topics': topics}
+
+# run one script, returning the wall time and the metrics it recorded
+def run_script(script, script_args, data_dir):
+    metrics_file = os.path.join(data_dir, 'metrics.json')
+    command = [sys.executable, os.path.join(SCRIPT_DIR, script)] + script_args + ['--metrics-json', metrics_file]
+    start = time.perf_counter()
+    # the scripts print warnings about duplicate names, which are expected here
+    subprocess.run(command, cwd=data_dir, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+    seconds = time.perf_counter() - start
+    with open(metrics_file) as f:
+        metrics = json.load(f)
+    os.remove(metrics_file)
+    return {'wall_seconds': seconds, 'metrics': metrics}
+
+# run the benchmarks at one scale, each the given number of times
+def run_scale(posts, args, data_dir):
+    sizes = get_data_sizes(posts, args)
+    start = time.perf_counter()
+    write_data(data_dir, **sizes, **get_content_options(args))
+    print(f'INFO: generated {posts} posts in {time.perf_counter() - start:.1f}s', file=sys.stderr)
+    results = []
+    for name, script, script_args in BENCHMARKS:
+        # benchmarks that were not chosen are still run once, to make the files needed by later ones
+        repeat = args.repeat if name in args.benchmarks else 1
+        runs = [run_script(script, script_args, data_dir) for _ in range(repeat)]
+        if name not in args.benchmarks:
+            continue
+        best = min(runs, key=lambda run: run['wall_seconds'])
+        results.append({
+            'benchmark': name,
+            'command': [script] + script_args,
+            'data': sizes,
+            'wall_seconds': best['wall_seconds'],
+            'peak_rss_mb': best['metrics']['total']['peak_rss_mb'],
+            'stages': best['metrics']['stages'],
+            'runs': [run['wall_seconds'] for run in runs],
+        })
+    return results
+
+# the version of the code being measured, if it is in a git repository
+def get_git_commit():
+    try:
+        result = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=SCRIPT_DIR, capture_output=True, text=True, check=True)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return result.stdout.strip()
+
+# the time for each benchmark and scale in earlier results, to compare with
+def load_baseline(filename):
+    with open(filename) as f:
+        data = json.load(f)
+    return {(result['benchmark'], result['data']['posts']): result['wall_seconds'] for result in data['results']}
+
+def main():
+    parser = argparse.ArgumentParser(description='Time the nicknames scripts on synthetic data at several scales')
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES, help='Numbers of posts to generate')
+    parser.add_argument('--benchmarks', nargs='+', default=BENCHMARK_NAMES, choices=BENCHMARK_NAMES, help='Benchmarks to time (default: all)')
+    parser.add_argument('--repeat', type=int, default=3, help='Number of times to run each benchmark, keeping the fastest')
+    parser.add_argument('--posts-per-user', type=float, default=40, help='Number of posts for each user')
+    parser.add_argument('--posts-per-topic', type=float, default=20, help='Number of posts in each topic')
+    parser.add_argument('--posts-per-session', type=float, default=2000, help='Number of posts in each session')
+    add_content_arguments(parser)
+    parser.add_argument('--output-file', '-o', default='benchmark_results.json', help='Output JSON file for the results')
+    parser.add_argument('--baseline', help='JSON file of earlier results, to print the change in time (optional)')
+    parser.add_argument('--data-dir', help='Directory for the generated data, which is kept (default: a temporary directory)')
+    args = parser.parse_args()
+
+    baseline = load_baseline(args.baseline) if args.baseline else {}
+    results = []
+    print('benchmark\tposts\tseconds\tpeak MB' + ('\tchange' if baseline else ''))
+    for posts in args.scales:
+        if args.data_dir:
+            data_dir = os.path.join(args.data_dir, f'posts_{posts}')
+        else:
+            data_dir = tempfile.mkdtemp(prefix='nicknames-benchmark-')
+        try:
+            for result in run_scale(posts, args, data_dir):
+                results.append(result)
+                line = f'{result["benchmark"]}\t{posts}\t{result["wall_seconds"]:.3f}\t{result["peak_rss_mb"]:.1f}'
+                previous = baseline.get((result['benchmark'], posts))
+                if previous:
+                    line += f'\t{result["wall_seconds"] / previous - 1:+.1%}'
+                print(line, flush=True)
+        finally:
+            if not args.data_dir:
+                shutil.rmtree(data_dir)
+
+    output = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'git_commit': get_git_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'options': vars(args),
+        'results': results,
+    }
+    with open(args.output_file, 'w') as f:
+        json.dump(output, f, indent=2)
+
+if __name__ == '__main__':
+    # execute only if run as a script
+    main()
@@ -3,44 +3,86 @@
 # © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
 
 import argparse
+import re
+
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 
 from constants import TEXT_FIELD_NAME
-from messages import load_message_data, save_message_data
+from messages import load_message_chunks, load_message_data, save_message_chunks, save_message_data
+from metrics import add_metrics_arguments, create_metrics, measure, measure_chunks, report_metrics
+
+# a message wrapped in a pair of quotes
+OUTER_QUOTES_PATTERN = re.compile(r'^"(.*)"$')
 
 def clean_message_data(df, field):
-    field = df[field]
-    # remove outer quotes
-    pattern = r'^"(.*)"$'
-    replacement = r'\1'
-    replace_pattern(field, pattern, replacement)
-    # remove duplicated quote characters
-    pattern = r'""'
-    replacement = r'"'
-    replace_pattern(field, pattern, replacement)
-    # normalise white space
-    pattern = r'\s+'
-    replacement = r' '
-    replace_pattern(field, pattern, replacement)
-    # remove white space at start and end
-    pattern = r'(^ +)|( +$)'
-    replacement = r''
-    replace_pattern(field, pattern, replacement)
+    df[field] = df[field].map(clean_text)
     return df
 
-# replace the given pattern in the field data
-def replace_pattern(field, pattern, replacement, regex=True):
-    field.replace(pattern, replacement, regex=regex, inplace=True)
+# clean one message in a single pass, with the same result as replacing
+# outer quotes, duplicated quotes, runs of white space and white space at
+# the start and end in turn
+def clean_text(text):
+    if not isinstance(text, str):
+        return text
+    # most messages need no cleaning; isprintable is false for every white space
+    # character that split removes, except the space
+    if '"' not in text and text.isprintable() and '  ' not in text and not text.startswith(' ') and not text.endswith(' '):
+        return text
+    if '"' in text:
+        # remove outer quotes
+        text = OUTER_QUOTES_PATTERN.sub(r'\1', text, count=1)
+        # remove duplicated quote characters
+        text = text.replace('""', '"')
+    # normalise white space, and remove it at the start and end
+    return ' '.join(text.split())
+
+# clean each chunk of messages, optionally sharing the chunks between processes
+def clean_message_chunks(chunks, field, *, workers=1):
+    if workers <= 1:
+        for df in chunks:
+            yield clean_message_data(df, field)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = deque()
+        for df in chunks:
+            pending.append(executor.submit(clean_message_data, df, field))
+            # only read ahead a few chunks, and return them in order
+            if len(pending) > workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 def main():
     parser = argparse.ArgumentParser(description='Clean data')
-    parser.add_argument('input_file', metavar='input-file', help='Input CSV file')
-    parser.add_argument('output_file', metavar='output-file', help='Output CSV file')
+    parser.add_argument('input_file', metavar='input-file', help='Input messages file (CSV, Parquet, or Feather)')
+    parser.add_argument('output_file', metavar='output-file', help='Output messages file (CSV, Parquet, or Feather)')
     parser.add_argument('--field', default=TEXT_FIELD_NAME, help='Name of field to clean')
+    parser.add_argument('--chunksize', type=int, default=0, help='Number of messages to process at a time (optional)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to use (requires --chunksize)')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    df = load_message_data(args.input_file)
-    df = clean_message_data(df, args.field)
-    save_message_data(df, args.output_file)
+    if args.workers > 1 and args.chunksize <= 0:
+        parser.error('--workers requires --chunksize')
+
+    metrics = create_metrics(args, 'clean_data')
+    if args.chunksize > 0:
+        chunks = measure_chunks(metrics, 'load', load_message_chunks(args.input_file, args.chunksize))
+        chunks = measure_chunks(metrics, 'clean', clean_message_chunks(chunks, args.field, workers=args.workers))
+        with measure(metrics, 'write') as stage:
+            save_message_chunks(stage.count(chunks), args.output_file)
+    else:
+        with measure(metrics, 'load') as stage:
+            df = load_message_data(args.input_file)
+            stage.rows += len(df)
+        with measure(metrics, 'clean') as stage:
+            df = clean_message_data(df, args.field)
+            stage.rows += len(df)
+        with measure(metrics, 'write') as stage:
+            save_message_data(df, args.output_file)
+            stage.rows += len(df)
+    report_metrics(metrics, args)
 
 
 if __name__ == '__main__':
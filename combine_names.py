@@ -6,40 +6,37 @@ import argparse
 import sys
 
 from constants import CSV_NAME_LABEL, CSV_PSEUDONYM_LABEL
-from names import create_counter, load_names, load_names_csv, normalise_counter, update_counter, write_names
+from name_table import NameTable, load_names_table
+from metrics import add_metrics_arguments, create_metrics, measure, report_metrics
+from names import load_names_csv, write_names
 
 def combine_names(filenames, args, *, subtract=False, **kwargs):
     orig_names = None
     known_names = set()
-    names = create_counter()
+    # each file is added to a compact table as it is read
+    names = NameTable()
     for filename in filenames:
         if filename.endswith('.txt'):
-            load_names(filename, result=names, **kwargs)
+            load_names_table(filename, result=names, **kwargs)
         elif filename.endswith('.csv'):
-            load_names_csv(filename, args.csv_pseudonym, args.csv_name, result=names, **kwargs)
+            names.add_counter(load_names_csv(filename, args.csv_pseudonym, args.csv_name, **kwargs))
         else:
             print(f'Ignoring unknown file type {filename}', file=sys.stderr)
         if subtract and orig_names is None:
             orig_names = names
-            names = create_counter()
+            names = NameTable()
 
     if args.known_names:
-        for mapping in load_names(args.known_names, **kwargs).values():
-            known_names.update(mapping.keys())
+        known_names = load_names_table(args.known_names, **kwargs).name_set()
         if orig_names is None:
             orig_names = names
-            names = create_counter()
+            names = NameTable()
 
     if orig_names:
         # remove the unwanted name variants
-        for pseudonym in list(orig_names):
-            for name in names[pseudonym]:
-                orig_names[pseudonym].pop(name, None)
-            for name in known_names:
-                orig_names[pseudonym].pop(name, None)
-        names = orig_names
+        names = orig_names.subtract(names, known_names)
 
-    return normalise_counter(names)
+    return names.normalise()
 
 def main():
     parser = argparse.ArgumentParser(description='Combine names')
@@ -57,11 +54,18 @@ def main():
     parser.add_argument('-q', help='Sort names by frequency', action='store_true')
     parser.add_argument('-c', help='Output counts', action='store_true')
     parser.add_argument('-v', help='Verbose output', action='store_true')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
+    metrics = create_metrics(args, 'combine_names')
     keep_initials = not args.drop_initials
-    names = combine_names(args.filenames, args, subtract=args.subtract, divide=args.split_multi, initials=keep_initials, prefix=args.prefix)
-    write_names(args.output_file, names, by_frequency=args.q, with_counts=args.c, top_n=args.top)
+    with measure(metrics, 'combine') as stage:
+        names = combine_names(args.filenames, args, subtract=args.subtract, divide=args.split_multi, initials=keep_initials, prefix=args.prefix)
+        stage.rows += len(names)
+    with measure(metrics, 'write') as stage:
+        write_names(args.output_file, names, by_frequency=args.q, with_counts=args.c, top_n=args.top)
+        stage.rows += len(names)
+    report_metrics(metrics, args)
 
 if __name__ == '__main__':
     # execute only if run as a script
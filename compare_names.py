@@ -3,43 +3,70 @@
 # © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
 
 import argparse
+import csv
+import sys
 
 from collections import defaultdict, Counter
+from concurrent.futures import ProcessPoolExecutor
 
+from metrics import add_metrics_arguments, create_metrics, measure, report_metrics
+from name_table import load_names_table
 from names import load_names, sort_names
 
 TP = 'true_positive'
 FP = 'false_positive'
 FN = 'false_negative'
 
+# the columns of the table of results for many found names files
+TABLE_COLUMNS = [
+    'found_names', 'precision', 'recall', 'f1', TP, FP, FN,
+    'users', 'users_complete', 'coverage',
+    'connections_true', 'connections_found', 'connections_missed',
+    'unique_names_true', 'unique_names_found',
+    'substitutions_true', 'substitutions_found', 'substitutions_ratio',
+]
+
+# The true names, indexed once so they can be compared with many lists of found names
+class TrueNames:
+
+    def __init__(self, all_true_names):
+        self.pseudonyms = sorted(all_true_names)
+        self.names = {pseudonym: all_true_names[pseudonym] for pseudonym in self.pseudonyms}
+        self.name_sets = {pseudonym: set(names) for pseudonym, names in self.names.items()}
+        self.n_connections = sum(len(names) for names in self.name_sets.values())
+        self.unique_names = set().union(*self.name_sets.values())
+        self.n_substitutions = sum(sum(names.values()) for names in self.names.values())
+
 # A class for comparing true names and found names
 class Compare:
 
-    def __init__(self, all_true_names, all_found_names):
+    def __init__(self, all_true_names, all_found_names, *, index=None):
+        if index is None:
+            index = TrueNames(all_true_names)
         self.overall = Counter()
-        self.names_true = []
-        self.names_matching = []
+        self.n_names_true = index.n_connections
+        self.unique_names_true = index.unique_names
+        self.unique_names_matching = set()
         self.pseudonyms_missed = []
-        self.n_substitutions_true = 0
+        self.n_substitutions_true = index.n_substitutions
         self.n_substitutions_found = 0
         self.names_missed_per_pseudonym = defaultdict(set)
-        self.n_pseudonyms = len(all_true_names)
-        for pseudonym in sorted(all_true_names):
-            true_names = all_true_names[pseudonym]
+        self.n_pseudonyms = len(index.pseudonyms)
+        for pseudonym in index.pseudonyms:
+            true_names = index.names[pseudonym]
+            true_name_set = index.name_sets[pseudonym]
             # ignore any counts in the found names
-            found_names = set(all_found_names[pseudonym])
+            found_names = set(all_found_names.get(pseudonym, ()))
             if not found_names:
                 self.pseudonyms_missed.append(pseudonym)
-            missing_names = self.find_missing_names(true_names, found_names)
+            missing_names = self.find_missing_names(true_name_set, found_names)
             if missing_names:
                 self.names_missed_per_pseudonym[pseudonym] = missing_names
-            matching_names = self.find_matching_names(true_names, found_names)
-            self.names_true.extend(true_names)
-            self.names_matching.extend(matching_names)
+            matching_names = self.find_matching_names(true_name_set, found_names)
+            self.unique_names_matching.update(matching_names)
             self.overall[TP] += len(matching_names)
             self.overall[FP] += len(found_names - matching_names)
             self.overall[FN] += len(missing_names)
-            self.n_substitutions_true += sum(true_names.values())
             self.n_substitutions_found += sum([true_names[name] for name in matching_names])
 
     def print_report(self, verbose=False):
@@ -80,6 +107,20 @@ class Compare:
             result.append(f'{self.n_substitutions_found/self.n_substitutions_true:.1%}')
         return ' & '.join(result)
 
+    # the results as a row of the table, with the columns in TABLE_COLUMNS
+    def table_row(self, filename):
+        precision, recall, f1 = self.calculate_p_r_f1()
+        n_total, _, n_complete = self.count_pseudonyms()
+        n_connections_true, n_connections_missed, n_connections_found = self.count_connections()
+        n_unique_true, _, n_unique_found = self.count_unique_names()
+        return [
+            filename, f'{precision:.4f}', f'{recall:.4f}', f'{f1:.4f}', self.overall[TP], self.overall[FP], self.overall[FN],
+            n_total, n_complete, f'{self.safe_divide(n_complete, n_total):.4f}',
+            n_connections_true, n_connections_found, n_connections_missed,
+            n_unique_true, n_unique_found,
+            self.n_substitutions_true, self.n_substitutions_found, f'{self.safe_divide(self.n_substitutions_found, self.n_substitutions_true):.4f}',
+        ]
+
     def find_matching_names(self, true_names, found_names):
         return set(true_names) & set(found_names)
 
@@ -134,13 +175,13 @@ class Compare:
         return self.n_pseudonyms, n_incomplete, self.n_pseudonyms-n_incomplete
 
     def count_connections(self):
-        n_true = len(self.names_true)
+        n_true = self.n_names_true
         n_missed = self.overall[FN]
         return n_true, n_missed, n_true - n_missed
 
     def count_unique_names(self):
-        n_true = len(set(self.names_true))
-        n_matched = len(set(self.names_matching))
+        n_true = len(self.unique_names_true)
+        n_matched = len(self.unique_names_matching)
         return n_true, n_true - n_matched, n_matched
 
     def calculate_p_r_f1(self):
@@ -155,25 +196,73 @@ class Compare:
     def safe_divide(self, a, b):
         return a/b if b else 0
 
+# compare each found names file with the true names, optionally sharing the files between processes
+def compare_files(true_names, filenames, *, workers=1):
+    index = TrueNames(true_names)
+    if workers <= 1:
+        return [compare_file(filename, index) for filename in filenames]
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_index, initargs=(index,)) as executor:
+        return list(executor.map(compare_file_in_worker, filenames))
+
+def compare_file(filename, index):
+    return Compare(None, load_names_table(filename), index=index)
+
+# the true names for each worker process, indexed once when it starts
+index_state = {}
+
+def init_index(index):
+    index_state['index'] = index
+
+def compare_file_in_worker(filename):
+    return compare_file(filename, index_state['index'])
+
+def write_table(filename, results):
+    f = sys.stdout if filename is None else open(filename, 'w', newline='')
+    try:
+        writer = csv.writer(f)
+        writer.writerow(TABLE_COLUMNS)
+        for found_names, c in results:
+            writer.writerow(c.table_row(found_names))
+    finally:
+        if filename is not None:
+            f.close()
+
 def main():
     parser = argparse.ArgumentParser(description='Compare collected names against true names')
     parser.add_argument('true_names', help='Text file with true names for each pseudonym')
-    parser.add_argument('found_names', help='Text file with found names for each pseudonym')
+    parser.add_argument('found_names', nargs='+', help='Text file(s) with found names for each pseudonym')
     parser.add_argument('--report', help='Print a report as text', action='store_true')
     parser.add_argument('--summary', '-s', type=int, default=0, help='Print a LaTeX summary in a particular style')
+    parser.add_argument('--table', help='Print a CSV table of results, one row per found names file', action='store_true')
+    parser.add_argument('--output-file', '-o', help='Output CSV file for the table (default: stdout)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to use for comparing many files')
     parser.add_argument('-v', help='Verbose output', action='store_true')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    if not (args.report or args.summary):
+    if not (args.report or args.summary or args.table):
         args.report = True
 
-    true_names = load_names(args.true_names)
-    found_names = load_names(args.found_names)
-    c = Compare(true_names, found_names)
-    if args.report:
-        c.print_report(verbose=args.v)
-    if args.summary:
-        c.print_latex_summary(args.summary)
+    metrics = create_metrics(args, 'compare_names')
+    # the true names are only loaded and indexed once, however many files are compared
+    with measure(metrics, 'load') as stage:
+        true_names = load_names(args.true_names)
+        stage.rows += len(true_names)
+    with measure(metrics, 'compare') as stage:
+        results = list(zip(args.found_names, compare_files(true_names, args.found_names, workers=args.workers)))
+        stage.rows += len(results)
+    with measure(metrics, 'write') as stage:
+        for found_names, c in results:
+            if args.report:
+                if len(results) > 1:
+                    print(f'{found_names}:')
+                c.print_report(verbose=args.v)
+            if args.summary:
+                c.print_latex_summary(args.summary)
+        if args.table:
+            write_table(args.output_file, results)
+        stage.rows += len(results)
+    report_metrics(metrics, args)
 
 if __name__ == '__main__':
     # execute only if run as a script
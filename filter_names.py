@@ -4,25 +4,38 @@
 
 import argparse
 
-from messages import load_message_data, save_message_data
+from constants import TEXT_FIELD_NAME, USER_FIELD_NAME
+from messages import load_message_data
+from metrics import add_metrics_arguments, create_metrics, measure, report_metrics
 from names import load_names, write_names
 from replace_names import replace_names
 
 def main():
     parser = argparse.ArgumentParser(description='Remove names that do not appear in the data')
-    parser.add_argument('input_file', metavar='input-file', help='Input CSV file')
+    parser.add_argument('input_file', metavar='input-file', help='Input messages file (CSV, Parquet, or Feather)')
     parser.add_argument('names_file', metavar='names-file', help='Input text file with with names for each pseudonym')
     parser.add_argument('output_file', metavar='output-file', nargs='?', help='Output text file (optional)')
     parser.add_argument('-q', help='Sort names by frequency', action='store_true')
     parser.add_argument('-c', help='Output counts', action='store_true')
     parser.add_argument('-v', help='Verbose output', action='store_true')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    names = load_names(args.names_file)
-    df = load_message_data(args.input_file)
-    # count the upper bound of occurrences
-    names = replace_names(df, names, count_upper_bounds=True, verbose=args.v)
-    write_names(args.output_file, names, by_frequency=args.q, with_counts=args.c, verbose=args.v)
+    metrics = create_metrics(args, 'filter_names')
+    with measure(metrics, 'load') as stage:
+        names = load_names(args.names_file)
+        df = load_message_data(args.input_file, [TEXT_FIELD_NAME, USER_FIELD_NAME])
+        stage.rows += len(df)
+    with measure(metrics, 'substitute') as stage:
+        # count the upper bound of occurrences
+        names = replace_names(df, names, count_upper_bounds=True, metrics=metrics, verbose=args.v)
+        stage.rows += len(df)
+    with measure(metrics, 'write') as stage:
+        write_names(args.output_file, names, by_frequency=args.q, with_counts=args.c, verbose=args.v)
+        stage.rows += len(names)
+    if metrics is not None:
+        metrics.add_name_matches(names)
+    report_metrics(metrics, args)
 
 if __name__ == '__main__':
     # execute only if run as a script
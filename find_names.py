@@ -3,58 +3,112 @@
 # © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
 
 import argparse
+import os
 import re
+import sys
 
-from constants import NO_PARENT_VALUE, PARENT_USER_FIELD_NAME, TEXT_FIELD_NAME, USER_FIELD_NAME
-from messages import load_message_data
-from names import create_counter, update_counter, write_names
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from constants import NO_PARENT_VALUE, PARENT_USER_FIELD_NAME, POST_FIELD_NAME, TEXT_FIELD_NAME, USER_FIELD_NAME
+from manifest import Manifest, get_post_ids, has_duplicate_posts, hash_rows
+from messages import load_message_chunks, load_message_data
+from metrics import add_metrics_arguments, create_metrics, measure, measure_chunks, report_metrics
+from names import combine_counters, create_counter, update_counter, write_names
+from textwash_server import connect_washer, get_default_socket
+from token_cache import format_cache_stats
 
 METHOD_REGEX = 'regex'
 METHOD_TEXTWASH = 'textwash'
 METHOD_CHOICES = [METHOD_REGEX, METHOD_TEXTWASH]
 
+# number of messages to send to a Textwash worker at a time
+SHARD_SIZE = 250
+
+# the only columns needed to find names
+MESSAGE_COLUMNS = [POST_FIELD_NAME, TEXT_FIELD_NAME, USER_FIELD_NAME, PARENT_USER_FIELD_NAME]
+
+# patterns for names at the start and end of the messages
+TO_NAME_PATTERN = re.compile(r'^"?[hH][iI]\W+(\w+(-\w+)?)')
+FROM_NAME_PATTERN = re.compile(r'(\w+(-\w+)?(\s+\w\.?)?)"?$')
+
 def find_names(df, find_to_names, find_from_names):
-    names = create_counter()
+    return count_names(find_name_pairs(df, find_to_names, find_from_names))
+
+# find the names and linked pseudonyms in each message, indexed by row
+def find_name_pairs(df, find_to_names, find_from_names):
+    found = []
     if find_to_names and PARENT_USER_FIELD_NAME in df.columns:
-        posts = df[[TEXT_FIELD_NAME, PARENT_USER_FIELD_NAME]]
-        patterns = [
-            r'^"?[hH][iI]\W+(\w+(-\w+)?)',
-        ]
-        match_patterns(posts, patterns, names)
+        found.append(match_pattern(df[TEXT_FIELD_NAME], df[PARENT_USER_FIELD_NAME], TO_NAME_PATTERN))
     if find_from_names:
-        posts = df[[TEXT_FIELD_NAME, USER_FIELD_NAME]]
-        patterns = [
-            r'(\w+(-\w+)?(\s+\w\.?)?)"?$',
-        ]
-        match_patterns(posts, patterns, names)
+        found.append(match_pattern(df[TEXT_FIELD_NAME], df[USER_FIELD_NAME], FROM_NAME_PATTERN))
+    if not found:
+        return pd.DataFrame(columns=['name', 'pseudonym'])
+    return pd.concat(found)
+
+# collect all the names linked with each pseudonym
+def count_names(found):
     result = create_counter()
-    for name, pseudonyms in names.items():
-        if not re.fullmatch(r'\D+', name):
-            # exclude names containing digits
-            continue
-        # collect all the names linked with each pseudonym
-        for pseudonym, count in pseudonyms.most_common():
-            # skip unattributed names
-            if pseudonym != NO_PARENT_VALUE:
-                update_counter(result[pseudonym], name, count=count)
+    # exclude names containing digits
+    found = found[found['name'].str.fullmatch(r'\D+')]
+    # skip unattributed names
+    found = found[found['pseudonym'] != NO_PARENT_VALUE]
+    # count all the names linked with each pseudonym at once
+    counts = found.groupby(['pseudonym', 'name'], sort=False, dropna=False).size()
+    for (pseudonym, name), count in counts.items():
+        update_counter(result[pseudonym], name, count=count)
     return result
 
-def match_patterns(posts, patterns, names):
-    # print(posts.columns)
-    for pattern in patterns:
-        for _, (body, pseudonym) in posts.iterrows():
-            match = re.search(pattern, body)
-            if match:
-                # print(f'{match.group()}')
-                name = match.group(1)
-                # drop internal punctuation
-                name = name.replace('.', '')
-                # collect all the pseudonyms linked with this name
-                update_counter(names[name], pseudonym)
+# find the first match of the pattern in each message
+def match_pattern(bodies, pseudonyms, pattern):
+    names = bodies.str.extract(pattern, expand=True)[0]
+    found = names.notna()
+    # drop internal punctuation
+    names = names[found].str.replace('.', '', regex=False)
+    # pseudonyms are stored as strings, whatever their type in the data
+    pseudonyms = pseudonyms[found].astype(str).str.strip()
+    return pd.DataFrame({'name': names, 'pseudonym': pseudonyms})
+
+# find names only in posts that are new or changed since the run recorded in the manifest,
+# reusing the names found before for the rest; updates the manifest
+def find_names_incremental(df, find_to_names, find_from_names, manifest, *, verbose=False):
+    post_ids = get_post_ids(df).tolist()
+    hashes = hash_rows(df, [c for c in MESSAGE_COLUMNS if c in df.columns]).tolist()
+    old_posts = manifest.find_posts(post_ids)
+    changed = [old_posts.get(post_id, (None,))[0] != post_hash for post_id, post_hash in zip(post_ids, hashes)]
+    found = find_name_pairs(df[changed], find_to_names, find_from_names)
+    new_pairs = defaultdict(list)
+    for pos, name, pseudonym in zip(df.index.get_indexer(found.index), found['name'], found['pseudonym']):
+        new_pairs[pos].append([name, pseudonym])
+    posts = {}
+    pairs = []
+    for pos, (post_id, post_hash, is_changed) in enumerate(zip(post_ids, hashes, changed)):
+        if is_changed:
+            record = {'pairs': new_pairs[pos]}
+            posts[post_id] = (post_hash, record)
+        else:
+            record = old_posts[post_id][1]
+        pairs.extend(record['pairs'])
+    if verbose:
+        print(f'INFO: found names in {len(posts)} new or changed posts out of {len(df)}', file=sys.stderr)
+    manifest.save_posts(posts)
+    return count_names(pd.DataFrame(pairs, columns=['name', 'pseudonym']))
+
+# find names in the data, reading one chunk of messages at a time
+def find_names_chunked(filename, chunksize, find_to_names, find_from_names, *, start=0, limit=0, metrics=None):
+    names = create_counter()
+    # read every value as text, as the types inferred for each chunk can differ, e.g. 1234 and 1234.0
+    chunks = load_message_chunks(filename, chunksize, MESSAGE_COLUMNS, start=start, limit=limit, dtype=str)
+    for df in measure_chunks(metrics, 'load', chunks):
+        with measure(metrics, 'discover') as stage:
+            combine_counters(names, find_names(df, find_to_names, find_from_names))
+            stage.rows += len(df)
+    return names
 
 # Use TextWash to find names in the data
-def find_names_textwash(df, find_to_names, find_from_names):
-    from textwash_wrapper import Washer
+def find_names_textwash(df, find_to_names, find_from_names, *, workers=1, shard_size=SHARD_SIZE, server=None, **kwargs):
     columns = [TEXT_FIELD_NAME]
     if find_to_names and PARENT_USER_FIELD_NAME in df.columns:
         columns += [PARENT_USER_FIELD_NAME]
@@ -62,14 +116,79 @@ def find_names_textwash(df, find_to_names, find_from_names):
         columns += [USER_FIELD_NAME]
     posts = df[columns]
     data = [(users, body) for _, (body, *users) in posts.iterrows()]
-    result = Washer().find_names(data)
+    if server:
+        client = connect_washer(server)
+        if client is None:
+            raise RuntimeError(f'no Textwash server is running at {server}')
+        # the model is already loaded, with the options the server was started with
+        print(f'INFO: using the Textwash server at {server}', file=sys.stderr)
+        with client:
+            result = find_names_textwash_server(client, data, shard_size)
+    elif workers <= 1:
+        from textwash_wrapper import Washer
+        washer = Washer(**kwargs)
+        result = washer.find_names(data)
+        if washer.cache is not None:
+            print(format_cache_stats(*washer.cache.pop_stats()), file=sys.stderr)
+    else:
+        result = find_names_textwash_parallel(data, workers, shard_size, **kwargs)
     # skip unattributed names
     result.pop(NO_PARENT_VALUE, None)
     return result
 
+# share the messages between worker processes, each loading the model once
+def find_names_textwash_parallel(data, workers, shard_size, *, threads=None, **kwargs):
+    if not threads:
+        # avoid running more threads than there are cores
+        threads = max(1, (os.cpu_count() or 1) // workers)
+    shards = (data[idx:idx+shard_size] for idx in range(0, len(data), shard_size))
+    result = create_counter()
+    hits, misses = 0, 0
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_washer, initargs=(threads, kwargs)) as executor:
+        # merge the names from each shard as they are returned
+        for names, stats in executor.map(find_names_in_shard, shards):
+            combine_counters(result, names)
+            if stats is not None:
+                hits += stats[0]
+                misses += stats[1]
+    if kwargs.get('cache_file'):
+        print(format_cache_stats(hits, misses), file=sys.stderr)
+    return result
+
+# send the messages to a running server, one shard at a time
+def find_names_textwash_server(client, data, shard_size):
+    result = create_counter()
+    # only a server with a token cache returns statistics
+    cache = False
+    hits, misses = 0, 0
+    for idx in range(0, len(data), shard_size):
+        names, stats = client.find_names(data[idx:idx+shard_size])
+        combine_counters(result, names)
+        if stats is not None:
+            cache = True
+            hits += stats[0]
+            misses += stats[1]
+    if cache:
+        print(format_cache_stats(hits, misses), file=sys.stderr)
+    return result
+
+# the Textwash model for each worker process, loaded once when it starts
+washer_state = {}
+
+def init_washer(threads, kwargs):
+    from textwash_wrapper import Washer
+    washer_state['washer'] = Washer(threads=threads, **kwargs)
+
+def find_names_in_shard(shard):
+    washer = washer_state['washer']
+    names = washer.find_names(shard)
+    # also return the cache statistics for this shard
+    stats = None if washer.cache is None else washer.cache.pop_stats()
+    return names, stats
+
 def main():
     parser = argparse.ArgumentParser(description='Find personal names for each pseudonym')
-    parser.add_argument('input_file', metavar='input-file', help='Input CSV file')
+    parser.add_argument('input_file', metavar='input-file', help='Input messages file (CSV, Parquet, or Feather)')
     parser.add_argument('output_file', metavar='output-file', nargs='?', help='Output text file (optional)')
     parser.add_argument('-t', help="Find 'to' names", action='store_true')
     parser.add_argument('-f', help="Find 'from' names", action='store_true')
@@ -79,20 +198,70 @@ def main():
     parser.add_argument('--method', default=METHOD_REGEX, help='Method to use for searching for names', choices=METHOD_CHOICES)
     parser.add_argument('--start', type=int, default=0, help='First message to use')
     parser.add_argument('--limit', type=int, default=0, help='Maximum number of messages to use')
+    parser.add_argument('--chunksize', type=int, default=0, help='Number of messages to process at a time (regex method only)')
+    parser.add_argument('--batch-size', type=int, default=1, help='Number of messages to pass to the model at once, above 1 only with --experimental-batching (textwash method only)')
+    parser.add_argument('--experimental-batching', help='Allow a batch size above 1, which finds names without the Textwash anonymiser (textwash method only)', action='store_true')
+    parser.add_argument('--threads', type=int, default=None, help='Number of threads for model inference (textwash method only)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to use, each loading the model (textwash method only)')
+    parser.add_argument('--shard-size', type=int, default=SHARD_SIZE, help='Number of messages to send to a worker at a time (textwash method only)')
+    parser.add_argument('--cache', help='File for caching the tokens found in each message (textwash method only)')
+    parser.add_argument('--server', nargs='?', const=get_default_socket(), metavar='SOCKET', help=f'Use a running textwash_server.py instead of loading the model, at the given socket or {get_default_socket()} (textwash method only)')
+    parser.add_argument('--manifest', help='File recording the previous run, to only process new or changed posts (regex method only)')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
     if not args.t and not args.f:
         args.t = True
         args.f = True
 
-    df = load_message_data(args.input_file)
-    if args.limit > 0:
-        df = df[args.start:args.start+args.limit]
-    if args.method == METHOD_REGEX:
-        names = find_names(df, args.t, args.f)
-    elif args.method == METHOD_TEXTWASH:
-        names = find_names_textwash(df, args.t, args.f)
-    write_names(args.output_file, names, by_frequency=args.q, with_counts=args.c, verbose=args.v)
+    if args.chunksize > 0 and args.method != METHOD_REGEX:
+        parser.error('--chunksize is only supported with the regex method')
+    if args.manifest and (args.method != METHOD_REGEX or args.chunksize > 0 or args.workers > 1):
+        parser.error('--manifest is only supported with the regex method, without --chunksize or --workers')
+    if args.batch_size > 1 and not args.experimental_batching:
+        parser.error('--batch-size above 1 is experimental; add --experimental-batching to use it')
+    if args.server:
+        if args.method != METHOD_TEXTWASH:
+            parser.error('--server is only supported with the textwash method')
+        # the server uses the options it was started with
+        server_options = {'--workers': args.workers > 1, '--batch-size': args.batch_size != 1, '--experimental-batching': args.experimental_batching, '--threads': args.threads is not None, '--cache': args.cache is not None}
+        ignored = [option for option, used in server_options.items() if used]
+        if ignored:
+            parser.error(f'{", ".join(ignored)} cannot be used with --server; set them when starting textwash_server.py')
+
+    metrics = create_metrics(args, 'find_names')
+    if args.chunksize > 0:
+        names = find_names_chunked(args.input_file, args.chunksize, args.t, args.f, start=args.start, limit=args.limit, metrics=metrics)
+    else:
+        with measure(metrics, 'load') as stage:
+            df = load_message_data(args.input_file, MESSAGE_COLUMNS)
+            if args.limit > 0:
+                df = df[args.start:args.start+args.limit]
+            stage.rows += len(df)
+        with measure(metrics, 'discover') as stage:
+            if args.manifest and has_duplicate_posts(df):
+                # the records are kept by post ID, so they cannot be matched to the posts
+                print(f'WARNING: the post IDs in {args.input_file} are not unique -- processing all the posts', file=sys.stderr)
+                manifest = Manifest(args.manifest, {'to': args.t, 'from': args.f})
+                manifest.clear()
+                manifest.close()
+                names = find_names(df, args.t, args.f)
+            elif args.manifest:
+                manifest = Manifest(args.manifest, {'to': args.t, 'from': args.f})
+                names = find_names_incremental(df, args.t, args.f, manifest, verbose=args.v)
+                manifest.close()
+            elif args.method == METHOD_REGEX:
+                names = find_names(df, args.t, args.f)
+            elif args.method == METHOD_TEXTWASH:
+                try:
+                    names = find_names_textwash(df, args.t, args.f, workers=args.workers, shard_size=args.shard_size, server=args.server, batch_size=args.batch_size, threads=args.threads, cache_file=args.cache)
+                except (PermissionError, RuntimeError) as e:
+                    sys.exit(f'ERROR: {e}')
+            stage.rows += len(df)
+    with measure(metrics, 'write') as stage:
+        write_names(args.output_file, names, by_frequency=args.q, with_counts=args.c, verbose=args.v)
+        stage.rows += len(names)
+    report_metrics(metrics, args)
 
 if __name__ == '__main__':
     # execute only if run as a script
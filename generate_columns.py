@@ -5,25 +5,66 @@
 import argparse
 
 from constants import NO_PARENT_VALUE, PARENT_FIELD_NAME, PARENT_USER_FIELD_NAME, POST_FIELD_NAME, USER_FIELD_NAME
-from messages import load_message_data, save_message_data
+from messages import load_message_chunks, load_message_data, save_message_chunks, save_message_data
+from metrics import add_metrics_arguments, create_metrics, measure, measure_chunks, report_metrics
+from post_index import load_post_index
 
-def generate_columns(df):
+# add the parent pseudonym for each post, optionally looking up parents in an index
+# of the posts seen before; the posts in this data are added to the index first
+def generate_columns(df, index=None):
     mapping = {POST_FIELD_NAME: PARENT_FIELD_NAME, USER_FIELD_NAME: PARENT_USER_FIELD_NAME}
-    parents = df[[POST_FIELD_NAME, USER_FIELD_NAME]].rename(columns=mapping)
+    if index is None:
+        parents = df[[POST_FIELD_NAME, USER_FIELD_NAME]].rename(columns=mapping)
+    else:
+        index.update(df[POST_FIELD_NAME], df[USER_FIELD_NAME])
+        parents = find_parents(df[PARENT_FIELD_NAME], index)
     merged = df[[PARENT_FIELD_NAME]].merge(parents, on=PARENT_FIELD_NAME, how='left', sort=False, validate='many_to_one').fillna(NO_PARENT_VALUE, downcast='infer')
     # insert parent user name after post user name
     df.insert(df.columns.get_loc(USER_FIELD_NAME)+1, PARENT_USER_FIELD_NAME, merged[PARENT_USER_FIELD_NAME])
     return df
 
+# the parent posts found in the index, in the same form as the posts in the data
+def find_parents(parent_ids, index):
+    parent_ids = parent_ids.drop_duplicates()
+    pseudonyms, found = index.lookup(parent_ids)
+    return parent_ids[found].to_frame(PARENT_FIELD_NAME).assign(**{PARENT_USER_FIELD_NAME: pseudonyms})
+
 def main():
     parser = argparse.ArgumentParser(description='Generate additional column for parent user ID')
-    parser.add_argument('input_file', metavar='input-file', help='Input CSV file')
-    parser.add_argument('output_file', metavar='output-file', help='Output CSV file')
+    parser.add_argument('input_file', metavar='input-file', help='Input messages file (CSV, Parquet, or Feather)')
+    parser.add_argument('output_file', metavar='output-file', help='Output messages file (CSV, Parquet, or Feather)')
+    parser.add_argument('--index', help='Directory with the posts seen by earlier runs, updated with the new posts (optional)')
+    parser.add_argument('--chunksize', type=int, default=0, help='Number of messages to process at a time (optional)')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    df = load_message_data(args.input_file)
-    df = generate_columns(df)
-    save_message_data(df, args.output_file)
+    metrics = create_metrics(args, 'generate_columns')
+    index = None
+    if args.index or args.chunksize > 0:
+        with measure(metrics, 'load index') as stage:
+            index = load_post_index(args.index)
+            stage.rows += len(index)
+    if args.chunksize > 0:
+        # parents in earlier chunks are found in the index
+        chunks = measure_chunks(metrics, 'load', load_message_chunks(args.input_file, args.chunksize))
+        chunks = measure_chunks(metrics, 'generate', (generate_columns(df.reset_index(drop=True), index) for df in chunks))
+        with measure(metrics, 'write') as stage:
+            save_message_chunks(stage.count(chunks), args.output_file)
+    else:
+        with measure(metrics, 'load') as stage:
+            df = load_message_data(args.input_file)
+            stage.rows += len(df)
+        with measure(metrics, 'generate') as stage:
+            df = generate_columns(df, index)
+            stage.rows += len(df)
+        with measure(metrics, 'write') as stage:
+            save_message_data(df, args.output_file)
+            stage.rows += len(df)
+    if args.index:
+        with measure(metrics, 'save index') as stage:
+            index.save(args.index)
+            stage.rows += len(index)
+    report_metrics(metrics, args)
 
 if __name__ == '__main__':
     # execute only if run as a script
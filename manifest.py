@@ -0,0 +1,85 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+# A record of the posts handled by a previous run, so that later runs over a
+# growing data set only need to process the posts that are new or changed
+
+import hashlib
+import json
+import sqlite3
+
+from constants import POST_FIELD_NAME
+
+# hash the contents of a file, e.g. the names used for a run
+def hash_file(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 16), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+# hash a list of values, e.g. the pseudonyms in a group
+def hash_values(values):
+    return hashlib.sha256('\0'.join(map(str, values)).encode('utf-8')).hexdigest()
+
+# hash the given columns of each row, treating all values as text
+def hash_rows(df, columns):
+    import pandas as pd
+    hashes = pd.util.hash_pandas_object(df[columns].astype(str), index=False)
+    return hashes.map('{:016x}'.format)
+
+# the post IDs as text, to use as keys in the manifest
+def get_post_ids(df):
+    return df[POST_FIELD_NAME].astype(str)
+
+# whether any post ID appears more than once, so the posts cannot be told apart
+def has_duplicate_posts(df):
+    return get_post_ids(df).duplicated().any()
+
+# The record of the previous run, stored in SQLite so that a run only reads
+# the records of the posts in its data and only writes the records that have
+# changed. Nothing is written to the file until the manifest is closed.
+class Manifest:
+
+    def __init__(self, filename, options):
+        self.connection = sqlite3.connect(filename)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS options (value TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS groups (key TEXT PRIMARY KEY, hash TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS posts (post_id TEXT PRIMARY KEY, hash TEXT, record TEXT)')
+        # the posts in the current data
+        self.connection.execute('CREATE TEMP TABLE current (post_id TEXT PRIMARY KEY)')
+        self.options = options
+        row = self.connection.execute('SELECT value FROM options').fetchone()
+        if row is None or json.loads(row[0]) != options:
+            # everything must be processed again
+            self.clear()
+
+    # forget every post and group recorded before
+    def clear(self):
+        self.connection.execute('DELETE FROM options')
+        self.connection.execute('DELETE FROM groups')
+        self.connection.execute('DELETE FROM posts')
+        self.connection.execute('INSERT INTO options VALUES (?)', (json.dumps(self.options),))
+
+    def load_groups(self):
+        return dict(self.connection.execute('SELECT key, hash FROM groups'))
+
+    def save_groups(self, groups):
+        self.connection.execute('DELETE FROM groups')
+        self.connection.executemany('INSERT INTO groups VALUES (?, ?)', groups.items())
+
+    # the hash and record of each of the given posts handled before
+    def find_posts(self, post_ids):
+        self.connection.execute('DELETE FROM current')
+        self.connection.executemany('INSERT OR IGNORE INTO current VALUES (?)', ((post_id,) for post_id in post_ids))
+        rows = self.connection.execute('SELECT post_id, hash, record FROM posts JOIN current USING (post_id)')
+        return {post_id: (post_hash, json.loads(record)) for post_id, post_hash, record in rows}
+
+    # record the given posts, by post ID, and forget the posts no longer in the data
+    def save_posts(self, posts):
+        self.connection.execute('DELETE FROM posts WHERE post_id NOT IN (SELECT post_id FROM current)')
+        rows = ((post_id, post_hash, json.dumps(record)) for post_id, (post_hash, record) in posts.items())
+        self.connection.executemany('INSERT OR REPLACE INTO posts VALUES (?, ?, ?)', rows)
+
+    def close(self):
+        self.connection.commit()
+        self.connection.close()
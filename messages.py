@@ -1,20 +1,191 @@
 # © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
 
-import pandas as pd
+import os
 
-# import messages into pandas
-def load_message_data(filename):
-    df = pd.read_csv(filename)
+from constants import TEXT_FIELD_NAME, TIME_FIELD_NAME
+
+# pandas is only imported when messages are loaded, so that tools working
+# only with names files start quickly
+
+FORMAT_CSV = 'csv'
+FORMAT_PARQUET = 'parquet'
+FORMAT_FEATHER = 'feather'
+
+# binary columnar formats, chosen by file extension
+FORMAT_EXTENSIONS = {
+    '.parquet': FORMAT_PARQUET,
+    '.pq': FORMAT_PARQUET,
+    '.feather': FORMAT_FEATHER,
+    '.arrow': FORMAT_FEATHER,
+}
+
+# columns always stored as text in Parquet and Feather files, even when the
+# first chunk written has no values in them or only values that look like numbers
+STRING_FIELDS = [TEXT_FIELD_NAME, TIME_FIELD_NAME]
+
+def get_file_format(filename):
+    _, ext = os.path.splitext(filename)
+    return FORMAT_EXTENSIONS.get(ext.lower(), FORMAT_CSV)
+
+# import messages into pandas, optionally reading only some columns
+def load_message_data(filename, columns=None):
+    import pandas as pd
+    file_format = get_file_format(filename)
+    if file_format == FORMAT_CSV:
+        usecols = None if columns is None else lambda x: x in columns
+        df = pd.read_csv(filename, usecols=usecols)
+    else:
+        table = load_arrow_table(filename, file_format, columns)
+        df = table.to_pandas()
     # print(f'read {len(df)} records')
     return df
 
+# import messages into pandas, one chunk at a time
+# (any extra arguments are passed to the CSV reader)
+def load_message_chunks(filename, chunksize, columns=None, *, start=0, limit=0, **kwargs):
+    file_format = get_file_format(filename)
+    if file_format == FORMAT_CSV:
+        import pandas as pd
+        usecols = None if columns is None else lambda x: x in columns
+        if limit > 0:
+            kwargs.update(skiprows=range(1, start+1), nrows=limit)
+        with pd.read_csv(filename, chunksize=chunksize, usecols=usecols, **kwargs) as reader:
+            for df in reader:
+                yield df
+    else:
+        table = load_arrow_table(filename, file_format, columns)
+        if limit > 0:
+            table = table.slice(start, limit)
+        # the table is memory-mapped, so only one chunk is converted at a time
+        for offset in range(0, table.num_rows, chunksize):
+            yield table.slice(offset, chunksize).to_pandas()
+
+# read a Parquet or Feather file, memory-mapped
+def load_arrow_table(filename, file_format, columns=None):
+    import pyarrow as pa
+    if file_format == FORMAT_PARQUET:
+        import pyarrow.parquet as pq
+        reader = pq.ParquetFile(filename, memory_map=True)
+        names = reader.schema_arrow.names
+        if columns is not None:
+            columns = [name for name in names if name in columns]
+        return reader.read(columns=columns)
+    reader = pa.ipc.open_file(pa.memory_map(filename))
+    table = reader.read_all()
+    if columns is not None:
+        table = table.select([name for name in table.column_names if name in columns])
+    return table
+
 # export messages to file
 def save_message_data(df, filename):
-    with open(filename, 'w') as f:
-        df.to_csv(f, index=False)
+    save_message_chunks([df], filename)
+
+# export messages to file, one chunk at a time
+def save_message_chunks(chunks, filename):
+    file_format = get_file_format(filename)
+    if file_format == FORMAT_CSV:
+        with open(filename, 'w') as f:
+            header = True
+            for df in chunks:
+                df.to_csv(f, index=False, header=header)
+                header = False
+    else:
+        save_arrow_chunks(chunks, filename, file_format)
+
+# write a Parquet or Feather file, using the schema of the first chunk with the
+# text columns as strings; if a later chunk has values that do not fit, the
+# schema is widened and the rows already written are rewritten to match
+def save_arrow_chunks(chunks, filename, file_format):
+    import pyarrow as pa
+    writer = None
+    schema = None
+    try:
+        for df in chunks:
+            if writer is None:
+                table = to_arrow_table(df)
+                schema = get_arrow_schema(table.schema)
+                table = table.cast(schema)
+                writer = open_arrow_writer(filename, file_format, schema)
+            else:
+                try:
+                    table = to_arrow_table(df, schema)
+                except (pa.ArrowInvalid, pa.ArrowTypeError):
+                    # e.g. a column of numbers in the first chunk with text in this one
+                    schema = widen_arrow_schema(schema, to_arrow_table(df).schema)
+                    writer.close()
+                    writer = None
+                    writer = rewrite_arrow_file(filename, file_format, schema)
+                    table = to_arrow_table(df, schema)
+            writer.write_table(table)
+    finally:
+        if writer is not None:
+            writer.close()
+
+def open_arrow_writer(filename, file_format, schema):
+    import pyarrow as pa
+    if file_format == FORMAT_PARQUET:
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(filename, schema)
+    return pa.ipc.new_file(filename, schema)
+
+# copy the rows written so far into a new file with the given schema, returning its writer
+def rewrite_arrow_file(filename, file_format, schema):
+    import pyarrow as pa
+    old_filename = f'{filename}.tmp'
+    os.replace(filename, old_filename)
+    writer = open_arrow_writer(filename, file_format, schema)
+    for batch in load_arrow_table(old_filename, file_format).to_batches():
+        writer.write_table(pa.Table.from_batches([batch]).cast(schema))
+    os.remove(old_filename)
+    return writer
+
+# the schema to write, with the text columns declared as strings
+def get_arrow_schema(schema):
+    import pyarrow as pa
+    for column in STRING_FIELDS:
+        idx = schema.get_field_index(column)
+        if idx >= 0:
+            schema = schema.set(idx, pa.field(column, pa.string()))
+    return schema
+
+# a schema that can hold the values of both, as a CSV reader would infer it
+# from the whole file: numbers stay numbers, and anything else becomes text
+def widen_arrow_schema(schema, other):
+    import pyarrow as pa
+    for idx, field in enumerate(schema):
+        if field.name not in other.names:
+            continue
+        a, b = field.type, other.field(field.name).type
+        if a == b or pa.types.is_null(b):
+            continue
+        if pa.types.is_null(a):
+            widened = b
+        elif all(pa.types.is_integer(t) or pa.types.is_boolean(t) for t in (a, b)):
+            widened = pa.int64()
+        elif all(pa.types.is_integer(t) or pa.types.is_floating(t) or pa.types.is_boolean(t) for t in (a, b)):
+            widened = pa.float64()
+        else:
+            widened = pa.string()
+        schema = schema.set(idx, pa.field(field.name, widened))
+    return schema
+
+def to_arrow_table(df, schema=None):
+    import pandas as pd
+    import pyarrow as pa
+    df = df.copy(deep=False)
+    for column in df.columns:
+        values = df[column]
+        if schema is not None and values.dtype != object and schema.field(column).type == pa.string():
+            # e.g. a column with no values, or only numbers, in this chunk but text in the first one
+            df[column] = values.astype(str).where(values.notna(), None)
+        # store columns with mixed types as text, as they would be in a CSV file
+        elif values.dtype == object and pd.api.types.infer_dtype(values, skipna=True).startswith('mixed'):
+            df[column] = values.where(values.isna(), values.astype(str))
+    return pa.Table.from_pandas(df, schema=schema, preserve_index=False)
 
 # load records from CSV file
 def load_csv(filename):
+    import pandas as pd
     df = pd.read_csv(filename, dtype=str)
     return df
 
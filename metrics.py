@@ -0,0 +1,206 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+# The wall time, CPU time, peak memory use and number of rows for each stage
+# of a run, printed with --profile or saved with --metrics-json. The time of a
+# stage does not include the time of any stage run inside it, so the stages
+# add up to the total, even when chunks are read lazily by a later stage.
+
+import json
+import os
+import resource
+import sys
+import time
+
+from contextlib import contextmanager
+
+# number of groups and names to list in the printed summary
+SUMMARY_SIZE = 10
+
+# the CPU time of this process, and of any child processes that have finished, such as workers
+def cpu_time():
+    times = os.times()
+    return times.user + times.system + times.children_user + times.children_system
+
+# the usage of child processes that have finished, which may include ones run
+# before this program started, such as by a shell wrapper
+def child_usage():
+    times = os.times()
+    return times.children_user + times.children_system, resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+
+# the peak memory use so far of this process, or of its largest child process
+def peak_rss_mb(who=resource.RUSAGE_SELF):
+    # the size is in bytes on macOS and kilobytes elsewhere
+    scale = 1 if sys.platform == 'darwin' else 1024
+    return resource.getrusage(who).ru_maxrss * scale / (1 << 20)
+
+# the memory in use now by this process, where the system reports it
+def current_rss_mb():
+    try:
+        with open('/proc/self/statm') as f:
+            pages = int(f.read().split()[1])
+    except (OSError, IndexError, ValueError):
+        return None
+    return pages * os.sysconf('SC_PAGE_SIZE') / (1 << 20)
+
+# the peak memory use during a stage: if the peak so far rose during the stage,
+# that is the peak of the stage, otherwise the larger of the memory in use at
+# its start and end (or the peak so far where that cannot be read)
+def stage_peak_rss_mb(start_peak, start_rss):
+    peak = peak_rss_mb()
+    rss = current_rss_mb()
+    if peak > start_peak or rss is None or start_rss is None:
+        return peak
+    return max(start_rss, rss)
+
+# The measurements for one stage, which may run many times, e.g. once per chunk
+class Stage:
+
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.peak_rss_mb = 0.0
+        self.rows = 0
+
+    # count the rows in each chunk as it is passed on
+    def count(self, chunks):
+        for df in chunks:
+            self.rows += len(df)
+            yield df
+
+    def to_dict(self):
+        return dict(vars(self))
+
+class Metrics:
+
+    def __init__(self, command):
+        self.command = command
+        self.argv = sys.argv[1:]
+        self.stages = {}
+        # the stages running now, innermost last, with their start times and the time of the stages inside them
+        self.active = []
+        # the time taken by each group of messages, and the number of matches for each name
+        self.groups = []
+        self.name_matches = {}
+        self.start_wall = time.perf_counter()
+        self.start_cpu = cpu_time()
+        self.start_child_usage = child_usage()
+
+    # measure the code run inside the with block
+    @contextmanager
+    def stage(self, name):
+        stage = self.stages.get(name) or Stage(name)
+        frame = [stage, time.perf_counter(), cpu_time(), 0.0, 0.0]
+        start_memory = peak_rss_mb(), current_rss_mb()
+        self.active.append(frame)
+        try:
+            yield stage
+        finally:
+            self.active.pop()
+            wall = time.perf_counter() - frame[1]
+            cpu = cpu_time() - frame[2]
+            stage.calls += 1
+            stage.wall_seconds += wall - frame[3]
+            stage.cpu_seconds += cpu - frame[4]
+            stage.peak_rss_mb = max(stage.peak_rss_mb, stage_peak_rss_mb(*start_memory))
+            # list the stages in the order they first finish, so stages that read chunks come first
+            self.stages.setdefault(name, stage)
+            if self.active:
+                self.active[-1][3] += wall
+                self.active[-1][4] += cpu
+
+    # measure the reading or processing of each chunk, counting the rows
+    def iterate(self, name, chunks):
+        chunks = iter(chunks)
+        while True:
+            with self.stage(name) as stage:
+                df = next(chunks, None)
+                if df is not None:
+                    stage.rows += len(df)
+            if df is None:
+                # the time spent finding there are no more chunks counts, but not as a call
+                stage.calls -= 1
+                return
+            yield df
+
+    def add_group(self, key, rows, seconds, matches):
+        self.groups.append({'group': str(key), 'rows': rows, 'seconds': seconds, 'matches': matches})
+
+    # add up the matches for each name, from nested Counters of names for each pseudonym
+    def add_name_matches(self, counts):
+        for names in counts.values():
+            for name, count in names.items():
+                self.name_matches[name] = self.name_matches.get(name, 0) + count
+
+    def to_dict(self):
+        return {
+            'command': self.command,
+            'argv': self.argv,
+            'total': {
+                'wall_seconds': time.perf_counter() - self.start_wall,
+                'cpu_seconds': cpu_time() - self.start_cpu,
+                'peak_rss_mb': peak_rss_mb(),
+                # only set if child processes ran during this run
+                'peak_child_rss_mb': peak_rss_mb(resource.RUSAGE_CHILDREN) if child_usage() != self.start_child_usage else None,
+            },
+            'stages': [stage.to_dict() for stage in self.stages.values()],
+            'groups': self.groups,
+            'name_matches': dict(sorted(self.name_matches.items(), key=lambda item: (-item[1], item[0]))),
+        }
+
+    def print_summary(self, file=sys.stderr):
+        data = self.to_dict()
+        width = max(len(name) for name in ['stage', 'total', *self.stages])
+        print(f'{"stage":<{width}} {"calls":>6} {"wall (s)":>10} {"cpu (s)":>10} {"peak RSS (MB)":>14} {"rows":>10}', file=file)
+        for stage in data['stages']:
+            print(f'{stage["name"]:<{width}} {stage["calls"]:>6} {stage["wall_seconds"]:>10.3f} {stage["cpu_seconds"]:>10.3f} {stage["peak_rss_mb"]:>14.1f} {stage["rows"]:>10}', file=file)
+        total = data['total']
+        print(f'{"total":<{width}} {"":>6} {total["wall_seconds"]:>10.3f} {total["cpu_seconds"]:>10.3f} {total["peak_rss_mb"]:>14.1f}', file=file)
+        if total['peak_child_rss_mb'] is not None:
+            print(f'peak RSS of any child process: {total["peak_child_rss_mb"]:.1f} MB', file=file)
+        if self.groups:
+            print(f'slowest groups (of {len(self.groups)}):', file=file)
+            for group in sorted(self.groups, key=lambda group: -group['seconds'])[:SUMMARY_SIZE]:
+                print(f'  {group["group"]}: {group["seconds"]:.3f}s, {group["rows"]} rows, {group["matches"]} matches', file=file)
+        if self.name_matches:
+            print(f'most matched names (of {len(self.name_matches)}):', file=file)
+            for name, count in list(data['name_matches'].items())[:SUMMARY_SIZE]:
+                print(f'  {name}: {count}', file=file)
+
+    def save(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+def add_metrics_arguments(parser):
+    parser.add_argument('--profile', help='Print the time and memory used by each stage', action='store_true')
+    parser.add_argument('--metrics-json', help='Output JSON file for the time and memory used by each stage (optional)')
+
+# create the metrics for a run if they were asked for, otherwise return None
+def create_metrics(args, command):
+    if args.profile or args.metrics_json:
+        return Metrics(command)
+    return None
+
+def report_metrics(metrics, args):
+    if metrics is None:
+        return
+    if args.profile:
+        metrics.print_summary()
+    if args.metrics_json:
+        metrics.save(args.metrics_json)
+
+# measure a stage if there are metrics; the stage can be used to count rows either way
+@contextmanager
+def measure(metrics, name):
+    if metrics is None:
+        yield Stage(name)
+    else:
+        with metrics.stage(name) as stage:
+            yield stage
+
+# measure the reading or processing of each chunk if there are metrics
+def measure_chunks(metrics, name, chunks):
+    if metrics is None:
+        return chunks
+    return metrics.iterate(name, chunks)
@@ -0,0 +1,107 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import heapq
+import re
+
+from collections import Counter
+
+from names import sort_names
+
+# build a regular expression matching any of the names, using a trie so
+# that names sharing a prefix are only tested once at each position
+def make_names_pattern(names):
+    trie = {}
+    for name in names:
+        node = trie
+        for char in name:
+            node = node.setdefault(char, {})
+        node[''] = True
+    return trie_to_pattern(trie)
+
+def trie_to_pattern(node):
+    is_end = '' in node
+    branches = [re.escape(char) + trie_to_pattern(child) for char, child in sorted(node.items()) if char]
+    if not branches:
+        return ''
+    if len(branches) == 1:
+        pattern = branches[0]
+    else:
+        pattern = '(?:{})'.format('|'.join(branches))
+    if is_end:
+        # try the longer names first
+        pattern = f'(?:{pattern})?'
+    return pattern
+
+# A matcher that replaces many names in a single pass over each message
+class NameMatcher:
+
+    def __init__(self, replacements, *, end=r'\b'):
+        # sort the mapping so we handle multi-word strings correctly
+        self.names = sort_names(replacements)
+        self.replacements = {name: replacements[name] for name in self.names}
+        self.priority = {name: idx for idx, name in enumerate(self.names)}
+        self.end = re.compile(end)
+        if self.names:
+            # a lookahead finds the longest name at every position, even overlapping ones
+            self.pattern = re.compile(rf'(?=\b({make_names_pattern(self.names)}){end})')
+        else:
+            self.pattern = None
+
+    # find the names to replace, as a sorted list of (start, name) pairs
+    def find_matches(self, text):
+        if self.pattern is None:
+            return []
+        candidates = [(self.priority[m.group(1)], m.start(), m.group(1)) for m in self.pattern.finditer(text)]
+        if len(candidates) < 2:
+            return [(start, name) for _, start, name in candidates]
+        # replace longer names first, as if each name were replaced in turn
+        heapq.heapify(candidates)
+        matches = []
+        taken = []
+        while candidates:
+            priority, start, name = heapq.heappop(candidates)
+            end = start + len(name)
+            if any(start < e and s < end for s, e in taken):
+                # fall back to a shorter name starting at the same position
+                shorter = self.find_shorter_name(text, start, name)
+                if shorter is not None:
+                    heapq.heappush(candidates, (self.priority[shorter], start, shorter))
+                continue
+            taken.append((start, end))
+            matches.append((start, name))
+        matches.sort()
+        return matches
+
+    # find the longest name that is a strict prefix of the given name and also matches here
+    def find_shorter_name(self, text, start, name):
+        for idx in range(len(name)-1, 0, -1):
+            prefix = name[:idx]
+            if prefix in self.priority and self.end.match(text, start+idx):
+                return prefix
+        return None
+
+    # replace all the names in the text, returning the new text and the names replaced
+    def substitute(self, text):
+        matches = self.find_matches(text)
+        if not matches:
+            return text, Counter()
+        parts = []
+        pos = 0
+        for start, name in matches:
+            parts.append(text[pos:start])
+            parts.append(self.replacements[name])
+            pos = start + len(name)
+        parts.append(text[pos:])
+        return ''.join(parts), Counter(name for _, name in matches)
+
+    # replace all the names in each message of the series
+    def substitute_series(self, series):
+        counts = Counter()
+        def substitute(text):
+            if not isinstance(text, str):
+                return text
+            text, found = self.substitute(text)
+            if found:
+                counts.update(found)
+            return text
+        return series.map(substitute), counts
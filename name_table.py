@@ -0,0 +1,223 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+from array import array
+from collections import Counter
+from collections.abc import Mapping
+from itertools import accumulate, chain, repeat
+
+# number of lines of a names file to parse before adding them to the table
+BLOCK_SIZE = 65536
+
+# A compact table of names and counts for each pseudonym: every string is
+# stored once, and each entry is a row of three integer arrays. It can be
+# used wherever a mapping from pseudonyms to Counters is read, including
+# write_names, with each Counter built when it is looked up. It is used by
+# combine_names, split_names and compare_names for the names they compare or
+# merge; the other tools change the Counters for each pseudonym, and load
+# names with load_names instead.
+class NameTable(Mapping):
+
+    def __init__(self):
+        # the pseudonyms and names, in the order they were first added
+        self.pseudonym_pool = []
+        self.pseudonym_ids = {}
+        self.name_pool = []
+        self.name_ids = {}
+        # one row per entry
+        self.pseudonyms = array('i')
+        self.names = array('i')
+        self.counts = array('q')
+        # the rows for each pseudonym, which may have none, like an empty Counter
+        self.starts = array('q')
+        self.ends = array('q')
+        # set when the rows for a pseudonym are not together, or a name is repeated
+        self.needs_merge = False
+
+    # add the names for each pseudonym in turn, where sizes gives the number for each one
+    def add_rows(self, pseudonyms, sizes, names, counts):
+        n_pseudonyms = len(self.pseudonym_pool)
+        p_ids = get_ids(pseudonyms, self.pseudonym_ids, self.pseudonym_pool)
+        n_ids = get_ids(names, self.name_ids, self.name_pool)
+        offsets = list(accumulate(sizes, initial=0))
+        if not self.needs_merge:
+            # pseudonyms seen before, or names repeated for the same pseudonym
+            if min(p_ids, default=n_pseudonyms) < n_pseudonyms or len(set(p_ids)) < len(p_ids):
+                self.needs_merge = True
+            elif any(len(set(n_ids[start:end])) < end - start for start, end in zip(offsets, offsets[1:]) if end - start > 1):
+                self.needs_merge = True
+        if self.needs_merge:
+            # the rows for each pseudonym are found when they are merged
+            padding = [0] * (len(self.pseudonym_pool) - len(self.starts))
+            self.starts.extend(padding)
+            self.ends.extend(padding)
+        else:
+            base = len(self.counts)
+            self.starts.extend([base + offset for offset in offsets[:-1]])
+            self.ends.extend([base + offset for offset in offsets[1:]])
+        self.pseudonyms.extend(array('i', chain.from_iterable(map(repeat, p_ids, sizes))))
+        self.names.extend(n_ids)
+        self.counts.extend(counts)
+
+    # group the rows by pseudonym, adding up the counts for repeated names
+    def merge(self):
+        keys = [(p << 32) | n for p, n in zip(self.pseudonyms, self.names)]
+        # the distinct pairs, in the order they were first added
+        merged = dict.fromkeys(keys, 0)
+        for key, count in zip(keys, self.counts):
+            merged[key] += count
+        pseudonyms = [key >> 32 for key in merged]
+        # a stable sort keeps the names for each pseudonym in order
+        order = sorted(range(len(pseudonyms)), key=pseudonyms.__getitem__)
+        keys = list(merged)
+        counts = list(merged.values())
+        self.pseudonyms = array('i', [pseudonyms[idx] for idx in order])
+        self.names = array('i', [keys[idx] & 0xffffffff for idx in order])
+        self.counts = array('q', [counts[idx] for idx in order])
+        sizes = [0] * len(self.pseudonym_pool)
+        for p in pseudonyms:
+            sizes[p] += 1
+        offsets = list(accumulate(sizes, initial=0))
+        self.starts = array('q', offsets[:-1])
+        self.ends = array('q', offsets[1:])
+        self.needs_merge = False
+
+    # all the entries, as (pseudonym, name, count) triples
+    def entries(self):
+        if self.needs_merge:
+            self.merge()
+        pseudonym_pool = self.pseudonym_pool
+        name_pool = self.name_pool
+        for p, n, count in zip(self.pseudonyms, self.names, self.counts):
+            yield pseudonym_pool[p], name_pool[n], count
+
+    def __getitem__(self, pseudonym):
+        p = self.pseudonym_ids[pseudonym]
+        if self.needs_merge:
+            self.merge()
+        start = self.starts[p]
+        end = self.ends[p]
+        name_pool = self.name_pool
+        return Counter({name_pool[n]: count for n, count in zip(self.names[start:end], self.counts[start:end])})
+
+    def __iter__(self):
+        return iter(self.pseudonym_pool)
+
+    def __len__(self):
+        return len(self.pseudonym_pool)
+
+    # add all the entries from nested Counters, such as those from load_names_csv
+    def add_counter(self, counter):
+        pseudonyms = list(counter)
+        sizes = [len(counter[pseudonym]) for pseudonym in pseudonyms]
+        names = [name for pseudonym in pseudonyms for name in counter[pseudonym]]
+        counts = [count for pseudonym in pseudonyms for count in counter[pseudonym].values()]
+        self.add_rows(pseudonyms, sizes, names, counts)
+
+    # all the names with an entry for any pseudonym
+    def name_set(self):
+        return set(self.name_pool)
+
+    # a new table with only the rows where keep is true, for all the pseudonyms or just the ones given
+    def select(self, keep, pseudonym_ids=None):
+        if self.needs_merge:
+            self.merge()
+        if pseudonym_ids is None:
+            pseudonym_ids = range(len(self.pseudonym_pool))
+        pseudonyms = []
+        sizes = []
+        rows = []
+        for p in pseudonym_ids:
+            size = len(rows)
+            rows.extend([row for row in range(self.starts[p], self.ends[p]) if keep[row]])
+            pseudonyms.append(self.pseudonym_pool[p])
+            sizes.append(len(rows) - size)
+        result = NameTable()
+        result.add_rows(pseudonyms, sizes, [self.name_pool[self.names[row]] for row in rows], [self.counts[row] for row in rows])
+        return result
+
+    # a new table without any of the names found for the same pseudonym in the other table,
+    # or any of the known names for every pseudonym
+    def subtract(self, other, known_names=()):
+        if self.needs_merge:
+            self.merge()
+        if other.needs_merge:
+            other.merge()
+        # look up each pair by its ids in the other table
+        other_pairs = {(p << 32) | n for p, n in zip(other.pseudonyms, other.names)}
+        other_pseudonyms = [other.pseudonym_ids.get(pseudonym, -1) for pseudonym in self.pseudonym_pool]
+        other_names = [other.name_ids.get(name, -1) for name in self.name_pool]
+        known = {self.name_ids[name] for name in known_names if name in self.name_ids}
+        keep = []
+        for p, n in zip(self.pseudonyms, self.names):
+            other_p = other_pseudonyms[p]
+            other_n = other_names[n]
+            keep.append(n not in known and (other_p < 0 or other_n < 0 or ((other_p << 32) | other_n) not in other_pairs))
+        return self.select(keep)
+
+    # a new table with only the positive counts, for pseudonyms whose counts add up
+    # to more than zero, like normalise_counter
+    def normalise(self):
+        if self.needs_merge:
+            self.merge()
+        pseudonym_ids = [p for p in range(len(self.pseudonym_pool)) if sum(self.counts[self.starts[p]:self.ends[p]]) > 0]
+        return self.select([count > 0 for count in self.counts], pseudonym_ids)
+
+# the id of each string, giving each new string the next id and adding it to the pool
+def get_ids(strings, ids, pool):
+    result = []
+    for string in strings:
+        idx = ids.get(string)
+        if idx is None:
+            idx = ids[string] = len(pool)
+            pool.append(string)
+        result.append(idx)
+    return result
+
+# load names and pseudonyms from a text file into a NameTable,
+# giving the same entries as load_names
+def load_names_table(filename, *, prefix=None, result=None, divide=False, initials=True):
+    if result is None:
+        result = NameTable()
+    pseudonyms = []
+    sizes = []
+    names = []
+    counts = []
+    with open(filename, 'r') as f:
+        for line in f:
+            pseudonym, *entries = line.split('|')
+            if not entries:
+                continue
+            pseudonym = pseudonym.strip()
+            if prefix and not pseudonym.startswith(prefix):
+                pseudonym = f'{prefix}{pseudonym}'
+            size = len(names)
+            if '[' not in line and not divide and initials:
+                # the common case, without frequency counts
+                names.extend([name.strip() for name in entries])
+                counts.extend([1] * len(entries))
+            else:
+                for name in entries:
+                    # handle files with frequency counts
+                    idx = name.find('[')
+                    if idx < 0:
+                        count = 1
+                    else:
+                        count = int(name[idx+1:].strip()[:-1])
+                        name = name[:idx]
+                    if divide:
+                        # split name on whitespace
+                        parts = name.split()
+                    else:
+                        parts = [name.strip()]
+                    for part in parts:
+                        # optionally ignore single initials
+                        if initials or len(part) > 1:
+                            names.append(part)
+                            counts.append(count)
+            pseudonyms.append(pseudonym)
+            sizes.append(len(names) - size)
+            if len(pseudonyms) >= BLOCK_SIZE:
+                result.add_rows(pseudonyms, sizes, names, counts)
+                pseudonyms, sizes, names, counts = [], [], [], []
+    result.add_rows(pseudonyms, sizes, names, counts)
+    return result
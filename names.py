@@ -7,19 +7,36 @@ from collections import defaultdict, Counter
 from messages import load_csv, load_text, write_text
 
 # load names and pseudonyms from CSV file
-def load_names_csv(filename, pseudonym_field, name_field, *, prefix=None, result=None, **kwargs):
+def load_names_csv(filename, pseudonym_field, name_field, *, prefix=None, result=None, divide=False, initials=True, **kwargs):
     if result is None:
         result = defaultdict(Counter)
     df = load_csv(filename)
-    names = df[[pseudonym_field, name_field]]
-    def read_entry(x):
-        pseudonym, name = x
-        if prefix and not pseudonym.startswith(prefix):
-            pseudonym = f'{prefix}{pseudonym}'
-        update_counter(result[pseudonym], name, **kwargs)
-    names.apply(read_entry, axis=1)
+    pseudonyms = df[pseudonym_field]
+    names = df[name_field]
+    if prefix:
+        pseudonyms = pseudonyms.mask(~pseudonyms.str.startswith(prefix, na=False), prefix + pseudonyms)
+    # every pseudonym gets an entry, even if all its names are dropped
+    for pseudonym in pseudonyms.unique():
+        result[pseudonym]
+    if divide:
+        # split names on whitespace, one part per row
+        names = names.str.split().explode().dropna()
+        pseudonyms = pseudonyms[names.index]
+    else:
+        names = names.fillna('nan').str.strip()
+    if not initials:
+        # ignore single initials
+        keep = names.str.len() > 1
+        names = names[keep]
+        pseudonyms = pseudonyms[keep]
+    # count all the names for each pseudonym at once
+    counts = names.groupby([pseudonyms.values, names.values], sort=False, dropna=False).size()
+    # as Python values, so the counts are plain integers
+    for (pseudonym, name), count in zip(counts.index.tolist(), counts.tolist()):
+        result[pseudonym][name] += count
+    return result
 
-# load names and pseudonyms from text file
+# load names and pseudonyms from text file (see load_names_table for a compact, read-only version)
 def load_names(filename, *, prefix=None, result=None, **kwargs):
     if result is None:
         result = defaultdict(Counter)
@@ -75,23 +92,42 @@ def sort_names(names):
     # sort by length (longest first) then alphabetically
     return sorted(list(names), key=lambda x: (-len(x), x))
 
-def print_names(names, *, by_frequency=False, with_counts=False, top_n=None, verbose=False, file=sys.stdout, **kwargs):
+def print_names(names, *, verbose=False, file=sys.stdout, **kwargs):
     # sort by pseudonym
     for key in sorted(names):
-        pairs = names[key].most_common(top_n)
-        if by_frequency:
-            # sort by frequency, then length, then alphabetically
-            pairs.sort(key=lambda x: (-x[1], -len(x[0]), x[0]))
-        else:
-            # sort by length then alphabetically
-            pairs.sort(key=lambda x: (-len(x[0]), x[0]))
-        if with_counts:
-            # combine names and counts
-            entries = [f'{name} [{count}]' for name, count in pairs]
-        else:
-            entries = dict(pairs)
-        values = ' | '.join(entries)
-        print(f'{key} | {values}', file=file)
+        print(format_names(key, names[key], **kwargs), file=file)
     if verbose:
         v = [sum(c.values()) for c in names.values()]
         print(f'Total connections: {sum(v)}', file=sys.stderr)
+
+# write the names for each pseudonym as they are generated, in the order given
+def write_names_stream(filename, entries, **kwargs):
+    if filename is None:
+        print_names_stream(entries, **kwargs)
+    else:
+        write_text(filename, lambda x: print_names_stream(entries, file=x, **kwargs))
+
+def print_names_stream(entries, *, verbose=False, file=sys.stdout, **kwargs):
+    total = 0
+    for key, counter in entries:
+        print(format_names(key, counter, **kwargs), file=file)
+        total += sum(counter.values())
+    if verbose:
+        print(f'Total connections: {total}', file=sys.stderr)
+
+# format the names for one pseudonym as a line of a names file
+def format_names(key, counter, *, by_frequency=False, with_counts=False, top_n=None, **kwargs):
+    pairs = counter.most_common(top_n)
+    if by_frequency:
+        # sort by frequency, then length, then alphabetically
+        pairs.sort(key=lambda x: (-x[1], -len(x[0]), x[0]))
+    else:
+        # sort by length then alphabetically
+        pairs.sort(key=lambda x: (-len(x[0]), x[0]))
+    if with_counts:
+        # combine names and counts
+        entries = [f'{name} [{count}]' for name, count in pairs]
+    else:
+        entries = dict(pairs)
+    values = ' | '.join(entries)
+    return f'{key} | {values}'
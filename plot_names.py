@@ -3,19 +3,9 @@
 # © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
 
 import argparse
-import pandas as pd
-
-import matplotlib as mpl
-mpl.use('Agg') # headless mode
-import matplotlib.pyplot as plt
-import matplotlib.ticker as ticker
-
-import seaborn
-seaborn.set()
-
-mpl.rcParams['axes.prop_cycle'] = mpl.cycler(color=['blue', 'purple', 'teal', 'skyblue', 'turquoise', 'lime', 'lavender', 'darkgreen'])
 
 from pathlib import Path    
+from metrics import add_metrics_arguments, create_metrics, measure, report_metrics
 from names import load_names, sort_names
 
 NAMES = {
@@ -25,7 +15,19 @@ NAMES = {
     'misspelled': 'Misspelled Name',
 }
 
+# matplotlib and seaborn are slow to import, so they are only loaded for plotting
+def init_plotting():
+    import matplotlib as mpl
+    mpl.use('Agg') # headless mode
+
+    import seaborn
+    seaborn.set()
+
+    mpl.rcParams['axes.prop_cycle'] = mpl.cycler(color=['blue', 'purple', 'teal', 'skyblue', 'turquoise', 'lime', 'lavender', 'darkgreen'])
+    return seaborn
+
 def load_data(filenames, sort=False, total=False):
+    import pandas as pd
     data = {}
     for filename in filenames:
         names = load_names(filename)
@@ -51,6 +53,8 @@ def savefig(fig, filename):
     fig.savefig(filename, dpi=300, bbox_inches='tight')
 
 def plot_data(df, title=None, size=(4, 3)):
+    import matplotlib.pyplot as plt
+    import matplotlib.ticker as ticker
     fig = plt.figure(figsize=size)
     n_bins = df.max(axis=1).max()
     ax = fig.add_subplot(1, 1, 1)
@@ -73,17 +77,26 @@ def plot_data(df, title=None, size=(4, 3)):
     return fig
 
 def main():
+    seaborn = init_plotting()
     # seaborn.set_context('poster')
     seaborn.set_context('paper')
 
     parser = argparse.ArgumentParser(description='Plot distributions of names')
     parser.add_argument('output_dir', help='Output directory')
     parser.add_argument('input_data', nargs='+', help='Input CSV data files')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    df = load_data(args.input_data, sort=True, total=True)
-    fig = plot_data(df, size=(6, 2))
-    savefig(fig, f'{args.output_dir}/names.png')
+    metrics = create_metrics(args, 'plot_names')
+    with measure(metrics, 'load') as stage:
+        df = load_data(args.input_data, sort=True, total=True)
+        stage.rows += len(df)
+    with measure(metrics, 'plot') as stage:
+        fig = plot_data(df, size=(6, 2))
+        stage.rows += len(df)
+    with measure(metrics, 'write'):
+        savefig(fig, f'{args.output_dir}/names.png')
+    report_metrics(metrics, args)
 
 if __name__ == '__main__':
     # execute only if run as a script
@@ -0,0 +1,136 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+# A persistent index from post IDs to the pseudonyms of the users who wrote
+# them, so that the parent of a post can be found even when the parent is in
+# an earlier chunk of the data, or in data processed on an earlier day
+
+import os
+
+import numpy as np
+
+# the files in an index directory, memory-mapped when the index is loaded
+KEYS_FILE = 'keys.npy'
+VALUES_FILE = 'values.npy'
+
+# An index stored as segments, each a pair of arrays sorted by post ID and
+# searched by bisection. New posts are added as a new segment, which is merged
+# with the one before it while that one is no larger, so each post is only
+# copied a logarithmic number of times however many chunks are added.
+class PostIndex:
+
+    def __init__(self, keys=None, values=None):
+        # oldest and largest first, with no post in more than one segment
+        self.segments = []
+        if keys is not None and len(keys) > 0:
+            self.segments.append((keys, values))
+
+    def __len__(self):
+        return sum(len(keys) for keys, _ in self.segments)
+
+    # add or replace the pseudonyms for the given posts
+    def update(self, post_ids, pseudonyms):
+        import pandas as pd
+        post_ids = np.asarray(post_ids)
+        pseudonyms = np.asarray(pseudonyms)
+        # posts with no ID can never be found as parents
+        known = ~pd.isna(post_ids)
+        post_ids, pseudonyms = post_ids[known], pseudonyms[known]
+        # if a post appears more than once, keep the last pseudonym
+        post_ids, last = np.unique(post_ids[::-1], return_index=True)
+        pseudonyms = pseudonyms[::-1][last]
+        new = np.ones(len(post_ids), dtype=bool)
+        for idx, (keys, values) in enumerate(self.segments):
+            positions, found = search(keys, post_ids)
+            if found.any():
+                values = values.astype(combined_dtype(values, pseudonyms), copy=False)
+                values[positions[found]] = pseudonyms[found]
+                self.segments[idx] = (keys, values)
+                new &= ~found
+        if new.any():
+            self.segments.append((post_ids[new], pseudonyms[new]))
+            self.merge()
+
+    # merge the newest segment into the one before it while that one is no larger
+    def merge(self):
+        while len(self.segments) > 1 and len(self.segments[-2][0]) <= len(self.segments[-1][0]):
+            self.segments[-2:] = [merge_segments(*self.segments[-2:])]
+
+    # find the pseudonyms for the given posts, and which of them were found
+    def lookup(self, post_ids):
+        post_ids = np.asarray(post_ids)
+        dtype = None
+        for _, values in self.segments:
+            dtype = values.dtype if dtype is None else promote_types(dtype, values.dtype)
+        result = np.empty(len(post_ids), dtype=np.int64 if dtype is None else dtype)
+        found = np.zeros(len(post_ids), dtype=bool)
+        for keys, values in self.segments:
+            positions, segment_found = search(keys, post_ids)
+            result[segment_found] = values[positions[segment_found]]
+            found |= segment_found
+        return result[found], found
+
+    # the whole index as one pair of sorted arrays
+    def compact(self):
+        while len(self.segments) > 1:
+            self.segments[-2:] = [merge_segments(*self.segments[-2:])]
+        if self.segments:
+            return self.segments[0]
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    # save the index as a directory of arrays that can be memory-mapped
+    def save(self, dirname):
+        keys, values = self.compact()
+        # store arrays of mixed types as text, as they would be in a CSV file
+        keys = keys.astype(str) if keys.dtype == object else keys
+        values = values.astype(str) if values.dtype == object else values
+        os.makedirs(dirname, exist_ok=True)
+        # write new files and then replace the old ones, which may still be mapped
+        for name, array in [(KEYS_FILE, keys), (VALUES_FILE, values)]:
+            path = os.path.join(dirname, name)
+            with open(f'{path}.tmp', 'wb') as f:
+                np.save(f, array)
+            os.replace(f'{path}.tmp', path)
+
+# insert the posts of a newer segment into an older one; both are sorted, so this is a single pass
+def merge_segments(segment, new_segment):
+    (keys, values), (new_keys, new_values) = segment, new_segment
+    keys = keys.astype(combined_dtype(keys, new_keys), copy=False)
+    values = values.astype(combined_dtype(values, new_values), copy=False)
+    positions = np.searchsorted(keys, new_keys)
+    return np.insert(keys, positions, new_keys), np.insert(values, positions, new_values)
+
+# the position of each post ID in the sorted keys, and whether it is there
+def search(keys, post_ids):
+    import pandas as pd
+    positions = np.zeros(len(post_ids), dtype=np.intp)
+    found = np.zeros(len(post_ids), dtype=bool)
+    # posts with no ID are never found
+    valid = np.flatnonzero(~pd.isna(post_ids))
+    positions[valid] = np.searchsorted(keys, post_ids[valid])
+    valid = valid[positions[valid] < len(keys)]
+    found[valid] = keys[positions[valid]] == post_ids[valid]
+    return positions, found
+
+# a type that can hold the values of both arrays
+def combined_dtype(a, b):
+    if len(a) == 0:
+        return b.dtype
+    if len(b) == 0:
+        return a.dtype
+    return promote_types(a.dtype, b.dtype)
+
+def promote_types(a, b):
+    try:
+        return np.promote_types(a, b)
+    except TypeError:
+        return np.dtype(object)
+
+# load an index saved by an earlier run, or start a new one; the arrays are
+# memory-mapped, so only the parts searched are read, and changes made in
+# memory are not written back until the index is saved
+def load_post_index(dirname):
+    if dirname is None or not os.path.exists(os.path.join(dirname, KEYS_FILE)):
+        return PostIndex()
+    keys = np.load(os.path.join(dirname, KEYS_FILE), mmap_mode='c')
+    values = np.load(os.path.join(dirname, VALUES_FILE), mmap_mode='c')
+    return PostIndex(keys, values)
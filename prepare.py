@@ -0,0 +1,50 @@
+#!/usr/bin/python3
+
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import argparse
+
+from clean_data import clean_message_data
+from constants import TEXT_FIELD_NAME
+from generate_columns import generate_columns
+from messages import load_message_data, save_message_data
+from metrics import add_metrics_arguments, create_metrics, measure, report_metrics
+from sort_data import sort_messages
+
+# clean, sort, and generate columns in one pass, without intermediate files
+def prepare_message_data(df, field, *, metrics=None):
+    df = run_stage('clean', metrics, clean_message_data, df, field)
+    df = run_stage('sort', metrics, sort_messages, df)
+    # renumber the rows, as if the sorted data had been saved and reloaded
+    df = df.reset_index(drop=True)
+    df = run_stage('generate', metrics, generate_columns, df)
+    return df
+
+# run one stage of processing, optionally recording the time taken and the number of rows
+def run_stage(name, metrics, fn, *args):
+    with measure(metrics, name) as stage:
+        result = fn(*args)
+        stage.rows += len(args[0])
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description='Clean data, sort it, and generate additional columns')
+    parser.add_argument('input_file', metavar='input-file', help='Input messages file (CSV, Parquet, or Feather)')
+    parser.add_argument('output_file', metavar='output-file', help='Output messages file (CSV, Parquet, or Feather)')
+    parser.add_argument('--field', default=TEXT_FIELD_NAME, help='Name of field to clean')
+    parser.add_argument('--timing', help='Print the time taken by each stage (the same as --profile)', action='store_true')
+    add_metrics_arguments(parser)
+    args = parser.parse_args()
+
+    args.profile = args.profile or args.timing
+    metrics = create_metrics(args, 'prepare')
+    with measure(metrics, 'load') as stage:
+        df = load_message_data(args.input_file)
+        stage.rows += len(df)
+    df = prepare_message_data(df, args.field, metrics=metrics)
+    run_stage('write', metrics, save_message_data, df, args.output_file)
+    report_metrics(metrics, args)
+
+if __name__ == '__main__':
+    # execute only if run as a script
+    main()
@@ -3,27 +3,37 @@
 # © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
 
 import argparse
-import re
 import sys
+import time
 
-from collections import defaultdict
+from collections import defaultdict, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+import pandas as pd
 
 from constants import ADDITIONAL_PSEUDONYMS, PSEUDONYM_ANON, SESSION_FIELD_NAME, TEXT_FIELD_NAME, TOPIC_FIELD_NAME, USER_FIELD_NAME
-from messages import load_message_data, save_message_data
-from names import combine_counters, create_counter, load_names, sort_names, update_counter, write_names
+from manifest import Manifest, get_post_ids, has_duplicate_posts, hash_file, hash_rows, hash_values
+from messages import load_message_chunks, load_message_data, save_message_chunks, save_message_data
+from metrics import add_metrics_arguments, create_metrics, measure, measure_chunks, report_metrics
+from name_matcher import NameMatcher
+from names import combine_counters, create_counter, load_names, update_counter, write_names
 
 GROUP_BY_NONE = 'none'
 GROUP_BY_TOPIC = 'topic'
 GROUP_BY_SESSION = 'session'
 GROUP_BY_CHOICES = [GROUP_BY_TOPIC, GROUP_BY_SESSION, GROUP_BY_NONE]
 
+# maximum number of replacement plans to keep for reuse
+PLAN_CACHE_SIZE = 128
+
 # find the pseudonyms present in this data
 def find_pseudonyms(df):
     # add additional pseudonyms for users added manually
     return sorted(df[USER_FIELD_NAME].astype(str).unique()) + ADDITIONAL_PSEUDONYMS
 
-# replace names using the mapping
-def replace_names(df, mapping, *, group_by=None, count_upper_bounds=False, **kwargs):
+# replace names using the mapping, optionally recording the time taken by each group
+def replace_names(df, mapping, *, group_by=None, count_upper_bounds=False, workers=1, plan_cache_size=PLAN_CACHE_SIZE, metrics=None, **kwargs):
     all_conflicts = set()
     all_counts = create_counter()
     temp_field_name = None
@@ -36,30 +46,179 @@ def replace_names(df, mapping, *, group_by=None, count_upper_bounds=False, **kwa
         field_name = TOPIC_FIELD_NAME
     elif group_by == GROUP_BY_SESSION:
         field_name = SESSION_FIELD_NAME
-    for group_name, group in df.groupby(field_name, sort=False, as_index=False, group_keys=False):
-        pseudonyms = find_pseudonyms(group)
-        if count_upper_bounds:
-            # treat each pseudonym independently, ignoring conflicts (counts are upper bounds)
-            for pseudonym in pseudonyms:
-                replacements = make_replacements({pseudonym: mapping[pseudonym]}, **kwargs)
-                _, counts = perform_substitutions(group[TEXT_FIELD_NAME], replacements)
-                combine_counters(all_counts, counts)
-        else:
-            replacements = make_replacements(mapping, valid_pseudonyms=pseudonyms, **kwargs)
-            substituted, counts = perform_substitutions(group[TEXT_FIELD_NAME], replacements)
-            df.loc[df[field_name] == group_name, TEXT_FIELD_NAME] = substituted
-            combine_counters(all_counts, counts)
-            # find name conflicts in this group
-            all_conflicts.update(find_conflicts(replacements))
+    groups = df.groupby(field_name, sort=False, as_index=False, group_keys=False)
+    # the row positions of each group, in the same order as the groups
+    positions = groups.indices
+    group_names = list(positions)
+    # only pass the columns needed to each group
+    group_data = (group[[TEXT_FIELD_NAME, USER_FIELD_NAME]] for _, group in groups)
+    results = map_groups(group_data, mapping, workers=workers, plan_cache_size=plan_cache_size, count_upper_bounds=count_upper_bounds, **kwargs)
+    # write the substituted text back by row position, rather than matching each group in the full data
+    texts = df[TEXT_FIELD_NAME].to_numpy(dtype=object, copy=True)
+    # merge the results in group order, so the output is always the same
+    for group_name, ((substituted, counts, conflicts), seconds) in zip(group_names, results):
+        if metrics is not None:
+            metrics.add_group(group_name, len(positions[group_name]), seconds, sum(sum(names.values()) for names in counts.values()))
+        if substituted is not None:
+            texts[positions[group_name]] = substituted.to_numpy(dtype=object)
+        combine_counters(all_counts, counts)
+        all_conflicts.update(conflicts)
+    if not count_upper_bounds:
+        df[TEXT_FIELD_NAME] = texts
     if temp_field_name:
         df.drop(columns=temp_field_name, inplace=True)
-    # report name conflicts
+    report_conflicts(all_conflicts)
+    return all_counts
+
+# replace names in a single group of messages
+def replace_group(group, mapping, *, plans=None, count_upper_bounds=False, **kwargs):
+    pseudonyms = find_pseudonyms(group)
+    if count_upper_bounds:
+        # treat each pseudonym independently, ignoring conflicts (counts are upper bounds)
+        all_counts = create_counter()
+        for pseudonym in pseudonyms:
+            if plans is None:
+                plan = make_plan({pseudonym: mapping[pseudonym]}, **kwargs)
+            else:
+                plan = plans(frozenset([pseudonym]))
+            _, counts = perform_substitutions(group[TEXT_FIELD_NAME], plan.replacements, plan.matcher)
+            combine_counters(all_counts, counts)
+        return None, all_counts, set()
+    if plans is None:
+        plan = make_plan(mapping, valid_pseudonyms=pseudonyms, **kwargs)
+    else:
+        plan = plans(frozenset(pseudonyms))
+    substituted, counts = perform_substitutions(group[TEXT_FIELD_NAME], plan.replacements, plan.matcher)
+    return substituted, counts, plan.conflicts
+
+# replace names in a single group of messages, also returning the time taken
+def replace_group_timed(group, mapping, **kwargs):
+    start = time.perf_counter()
+    result = replace_group(group, mapping, **kwargs)
+    return result, time.perf_counter() - start
+
+# replace names in each group, optionally using a pool of worker processes
+def map_groups(groups, mapping, *, workers=1, plan_cache_size=PLAN_CACHE_SIZE, **kwargs):
+    if workers <= 1:
+        plans = make_plan_cache(mapping, plan_cache_size, **kwargs)
+        for group in groups:
+            yield replace_group_timed(group, mapping, plans=plans, **kwargs)
+        return
+    initargs = (mapping, plan_cache_size, kwargs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=initargs) as executor:
+        # results are returned in the same order as the groups
+        yield from executor.map(replace_group_in_worker, groups)
+
+# the mapping and options for each worker process, set once when it starts
+worker_state = {}
+
+def init_worker(mapping, plan_cache_size, kwargs):
+    worker_state['mapping'] = mapping
+    worker_state['plans'] = make_plan_cache(mapping, plan_cache_size, **kwargs)
+    worker_state['kwargs'] = kwargs
+
+def replace_group_in_worker(group):
+    return replace_group_timed(group, worker_state['mapping'], plans=worker_state['plans'], **worker_state['kwargs'])
+
+# A replacement plan: the names to replace, a matcher for them, and any name conflicts
+ReplacementPlan = namedtuple('ReplacementPlan', ['replacements', 'matcher', 'conflicts'])
+
+# build the replacement plan for the given mapping
+def make_plan(mapping, **kwargs):
+    replacements = make_replacements(mapping, **kwargs)
+    return ReplacementPlan(replacements, make_matcher(replacements), find_conflicts(replacements))
+
+# reuse the replacement plans for groups with the same set of pseudonyms
+def make_plan_cache(mapping, maxsize, **kwargs):
+    @lru_cache(maxsize=maxsize)
+    def get_plan(pseudonyms):
+        if len(pseudonyms) == 1:
+            # look up the one pseudonym, rather than checking every one in the mapping
+            pseudonym, = pseudonyms
+            return make_plan({pseudonym: mapping[pseudonym]} if pseudonym in mapping else {}, **kwargs)
+        return make_plan(mapping, valid_pseudonyms=pseudonyms, **kwargs)
+    return get_plan
+
+# replace names across the full data set, one chunk at a time
+def replace_names_chunked(chunks, mapping, pseudonyms, counts, **kwargs):
+    plan = make_plan(mapping, valid_pseudonyms=pseudonyms, **kwargs)
+    for df in chunks:
+        substituted, chunk_counts = perform_substitutions(df[TEXT_FIELD_NAME], plan.replacements, plan.matcher)
+        df[TEXT_FIELD_NAME] = substituted
+        combine_counters(counts, chunk_counts)
+        yield df
+    report_conflicts(plan.conflicts)
+
+# replace names only in posts that are new or changed since the run recorded in the manifest,
+# reusing the previous output for the rest; returns the counts and updates the manifest
+def replace_names_incremental(df, mapping, manifest, *, group_by=None, plan_cache_size=PLAN_CACHE_SIZE, verbose=False, **kwargs):
+    post_ids = get_post_ids(df).tolist()
+    hashes = hash_rows(df, [TEXT_FIELD_NAME]).tolist()
+    if group_by is None or group_by == GROUP_BY_NONE:
+        group_keys = pd.Series('all', index=df.index)
+    elif group_by == GROUP_BY_TOPIC:
+        group_keys = df[TOPIC_FIELD_NAME].astype(str).where(df[TOPIC_FIELD_NAME].notna())
+    elif group_by == GROUP_BY_SESSION:
+        group_keys = df[SESSION_FIELD_NAME].astype(str).where(df[SESSION_FIELD_NAME].notna())
+    # posts must be processed again if the users in their group have changed
+    group_pseudonyms = {key: find_pseudonyms(group) for key, group in df.groupby(group_keys, sort=False)}
+    groups = {key: hash_values(pseudonyms) for key, pseudonyms in group_pseudonyms.items()}
+    old_groups = manifest.load_groups()
+    old_posts = manifest.find_posts(post_ids)
+    plans = make_plan_cache(mapping, plan_cache_size, verbose=verbose, **kwargs)
+    all_conflicts = set()
+    for pseudonyms in group_pseudonyms.values():
+        all_conflicts.update(plans(frozenset(pseudonyms)).conflicts)
+    texts = df[TEXT_FIELD_NAME].to_numpy(dtype=object, copy=True)
+    all_counts = create_counter()
+    # the records of the new or changed posts, with their output text
+    changed = {}
+    for pos, (post_id, text_hash, key) in enumerate(zip(post_ids, hashes, group_keys.tolist())):
+        if not isinstance(key, str):
+            # messages with no group are left unchanged
+            continue
+        old_hash, record = old_posts.get(post_id, (None, None))
+        if old_hash != text_hash or record['group'] != key or old_groups.get(key) != groups[key]:
+            plan = plans(frozenset(group_pseudonyms[key]))
+            texts[pos], counts = substitute_text(texts[pos], plan)
+            record = {'group': key, 'counts': counts, 'text': texts[pos]}
+            changed[post_id] = (text_hash, record)
+        else:
+            texts[pos] = record['text']
+        # total the counts for all the current posts
+        for pseudonym, name, count in record['counts']:
+            update_counter(all_counts[pseudonym], name, count=count)
+    df[TEXT_FIELD_NAME] = texts
+    if verbose:
+        print(f'INFO: replaced names in {len(changed)} new or changed posts out of {len(df)}', file=sys.stderr)
+    report_conflicts(all_conflicts)
+    manifest.save_groups(groups)
+    manifest.save_posts(changed)
+    return all_counts
+
+# replace the names in one message, returning the counts as (pseudonym, name, count) entries
+def substitute_text(text, plan):
+    if not isinstance(text, str):
+        return text, []
+    text, found = plan.matcher.substitute(text)
+    counts = [[plan.replacements[name][0][0], name, count] for name, count in sorted(found.items())]
+    return text, counts
+
+# find the pseudonyms present in data read in chunks
+def find_pseudonyms_chunked(chunks):
+    pseudonyms = set()
+    for df in chunks:
+        pseudonyms.update(df[USER_FIELD_NAME].astype(str).unique())
+    # add additional pseudonyms for users added manually
+    return sorted(pseudonyms) + ADDITIONAL_PSEUDONYMS
+
+# report name conflicts
+def report_conflicts(all_conflicts):
     for conflict in sorted(all_conflicts):
         name, repl_new, repl_orig = conflict
         print(f'WARNING: skipping duplicate name {name} for {repl_new} -- already mapped to {repl_orig}', file=sys.stderr)
     if all_conflicts:
         print(f'WARNING: found {len(all_conflicts)} duplicates in total', file=sys.stderr)
-    return all_counts
 
 # create the mapping from names to replacements and pseudonyms
 def make_replacements(mapping, *, valid_pseudonyms=None, anon_only=False, verbose=False, **kwargs):
@@ -74,19 +233,20 @@ def make_replacements(mapping, *, valid_pseudonyms=None, anon_only=False, verbos
                 print(f'INFO: replacing name {name} with {repl}', file=sys.stderr)
     return replacements
 
-# perform the substitutions
-def perform_substitutions(series, replacements):
+# make a matcher that replaces each name with the first matching entry
+def make_matcher(replacements):
+    return NameMatcher({name: entries[0][1] for name, entries in replacements.items()})
+
+# perform the substitutions in a single pass over each message
+def perform_substitutions(series, replacements, matcher=None):
     counts = create_counter()
-    # sort the mapping so we handle multi-word strings correctly
-    for name in sort_names(replacements):
-        pattern = rf'\b({re.escape(name)})\b'
-        # replace one name at a time, so we can count the replacements
-        n_matches = series.str.count(pattern).sum()
-        if n_matches > 0:
-            # replace each name with the first matching entry
-            pseudonym, repl = replacements[name][0]
-            series = series.replace(regex={pattern: repl})
-            update_counter(counts[pseudonym], name, count=n_matches)
+    if matcher is None:
+        matcher = make_matcher(replacements)
+    series, n_matches = matcher.substitute_series(series)
+    for name in matcher.names:
+        if n_matches[name] > 0:
+            pseudonym, _ = replacements[name][0]
+            update_counter(counts[pseudonym], name, count=n_matches[name])
     return series, counts
 
 # find duplicated names
@@ -110,24 +270,86 @@ def get_temp_field_name(df, base_name='tmp'):
 
 def main():
     parser = argparse.ArgumentParser(description='Replace names with pseudonyms and return substitution counts')
-    parser.add_argument('input_file', metavar='input-file', help='Input CSV file')
+    parser.add_argument('input_file', metavar='input-file', help='Input messages file (CSV, Parquet, or Feather)')
     parser.add_argument('names_file', metavar='names-file', help='Input text file with with names for each pseudonym')
-    parser.add_argument('output_file', metavar='output-file', nargs='?', help='Output CSV file (optional)')
+    parser.add_argument('output_file', metavar='output-file', nargs='?', help='Output messages file (CSV, Parquet, or Feather) (optional)')
     parser.add_argument('--used-names', help='Output text file (optional)')
     parser.add_argument('--by', help='Grouping option', choices=GROUP_BY_CHOICES, default=GROUP_BY_SESSION)
     parser.add_argument('--anon', help='Use the same pseudonym for every name', action='store_true')
     parser.add_argument('-q', help='Sort names by frequency', action='store_true')
     parser.add_argument('-c', help='Output counts', action='store_true')
     parser.add_argument('-v', help='Verbose output', action='store_true')
+    parser.add_argument('--chunksize', type=int, default=0, help='Number of messages to process at a time (with --by none only)')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes to use for replacing names in separate groups')
+    parser.add_argument('--plan-cache-size', type=int, default=PLAN_CACHE_SIZE, help='Number of replacement plans to reuse for groups with the same users')
+    parser.add_argument('--manifest', help='File recording the previous run, to only process new or changed posts (optional)')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    names = load_names(args.names_file)
-    df = load_message_data(args.input_file)
-    names = replace_names(df, names, group_by=args.by, anon_only=args.anon, verbose=args.v)
-    if args.output_file:
-        save_message_data(df, args.output_file)
+    if args.manifest:
+        if not args.output_file:
+            parser.error('--manifest requires an output file')
+        # the incremental run replaces names in the changed posts in one process, with all the data in memory
+        if args.workers > 1 or args.chunksize > 0:
+            parser.error('--manifest cannot be used with --workers or --chunksize')
+
+    metrics = create_metrics(args, 'replace_names')
+    with measure(metrics, 'load names') as stage:
+        names = load_names(args.names_file)
+        stage.rows += len(names)
+    manifest = None
+    if args.manifest:
+        # the previous output can only be reused if the names and options are the same
+        options = {'names': hash_file(args.names_file), 'by': args.by, 'anon': args.anon}
+        manifest = Manifest(args.manifest, options)
+    if args.chunksize > 0:
+        if args.by != GROUP_BY_NONE:
+            parser.error('--chunksize is only supported with --by none')
+        # find all the pseudonyms first, reading only that column
+        chunks = load_message_chunks(args.input_file, args.chunksize, [USER_FIELD_NAME], dtype=str)
+        with measure(metrics, 'discover'):
+            pseudonyms = find_pseudonyms_chunked(measure_chunks(metrics, 'load', chunks))
+        counts = create_counter()
+        # read every value as text, so each is written as it was read, whatever the types inferred for its chunk
+        chunks = measure_chunks(metrics, 'load', load_message_chunks(args.input_file, args.chunksize, dtype=str))
+        chunks = measure_chunks(metrics, 'substitute', replace_names_chunked(chunks, names, pseudonyms, counts, anon_only=args.anon, verbose=args.v))
+        with measure(metrics, 'write') as stage:
+            if args.output_file:
+                save_message_chunks(stage.count(chunks), args.output_file)
+            else:
+                for _ in stage.count(chunks):
+                    pass
+        names = counts
+    else:
+        with measure(metrics, 'load') as stage:
+            df = load_message_data(args.input_file)
+            stage.rows += len(df)
+        if manifest is not None and has_duplicate_posts(df):
+            # the records are kept by post ID, so they cannot be matched to the posts
+            print(f'WARNING: the post IDs in {args.input_file} are not unique -- processing all the posts', file=sys.stderr)
+            manifest.clear()
+            manifest.close()
+            manifest = None
+        with measure(metrics, 'substitute') as stage:
+            if manifest is not None:
+                names = replace_names_incremental(df, names, manifest, group_by=args.by, plan_cache_size=args.plan_cache_size, anon_only=args.anon, verbose=args.v)
+            else:
+                names = replace_names(df, names, group_by=args.by, workers=args.workers, plan_cache_size=args.plan_cache_size, metrics=metrics, anon_only=args.anon, verbose=args.v)
+            stage.rows += len(df)
+        if args.output_file:
+            with measure(metrics, 'write') as stage:
+                save_message_data(df, args.output_file)
+                stage.rows += len(df)
+        if manifest is not None:
+            # only record the run once the output has been written
+            manifest.close()
     if args.used_names:
-        write_names(args.used_names, names, by_frequency=args.q, with_counts=args.c, verbose=args.v)
+        with measure(metrics, 'write names') as stage:
+            write_names(args.used_names, names, by_frequency=args.q, with_counts=args.c, verbose=args.v)
+            stage.rows += len(names)
+    if metrics is not None:
+        metrics.add_name_matches(names)
+    report_metrics(metrics, args)
 
 if __name__ == '__main__':
     # execute only if run as a script
@@ -3,25 +3,148 @@
 # © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
 
 import argparse
+import heapq
+import os
+import pickle
+import tempfile
+
+from itertools import islice
 
 from constants import SESSION_FIELD_NAME, TIME_FIELD_NAME, TOPIC_FIELD_NAME
-from messages import load_message_data, save_message_data
+from messages import load_message_chunks, load_message_data, save_message_chunks, save_message_data
+from metrics import add_metrics_arguments, create_metrics, measure, measure_chunks, report_metrics
+
+SORT_FIELDS = [SESSION_FIELD_NAME, TOPIC_FIELD_NAME, TIME_FIELD_NAME]
+
+# largest number of sorted messages read back from each temporary file at a time
+MERGE_BLOCK_SIZE = 10000
 
 # sort messages
 def sort_messages(df):
+    if is_sorted(df):
+        return df
     # sort within sessions by topic thread and then by time
-    df = df.sort_values(by=[SESSION_FIELD_NAME, TOPIC_FIELD_NAME, TIME_FIELD_NAME])
+    df = df.sort_values(by=SORT_FIELDS)
     return df
 
+# check whether the messages are already in order, with missing values last as in sort_values
+def is_sorted(df):
+    import pandas as pd
+    # rows whose order is not yet decided by the fields compared so far
+    undecided = None
+    for field in SORT_FIELDS:
+        codes, uniques = pd.factorize(df[field], sort=True)
+        codes[codes < 0] = len(uniques)
+        diffs = codes[1:] - codes[:-1]
+        if undecided is None:
+            undecided = diffs == 0
+            if (diffs < 0).any():
+                return False
+        else:
+            if (undecided & (diffs < 0)).any():
+                return False
+            undecided &= diffs == 0
+    return True
+
+# the sort order of one message, with missing values last
+def sort_key(values):
+    return tuple((True, 0) if value is None or value != value else (False, value) for value in values)
+
+def get_sort_keys(df):
+    return map(sort_key, df[SORT_FIELDS].itertuples(index=False, name=None))
+
+# check whether the messages are already in order, reading only the sort fields
+def is_file_sorted(filename, chunksize):
+    last = None
+    for df in load_message_chunks(filename, chunksize, SORT_FIELDS):
+        if len(df) == 0:
+            continue
+        if not is_sorted(df):
+            return False
+        keys = get_sort_keys(df)
+        if last is not None and next(keys) < last:
+            return False
+        last = sort_key(df[SORT_FIELDS].iloc[-1])
+    return True
+
+# sort messages too many to hold in memory: each chunk is sorted and saved to a
+# temporary file, and then the files are merged, returning the sorted chunks
+def sort_message_chunks(chunks, chunksize, *, temp_dir=None):
+    with tempfile.TemporaryDirectory(prefix='sort-', dir=temp_dir) as run_dir:
+        runs = []
+        for df in chunks:
+            filename = os.path.join(run_dir, f'run-{len(runs)}.pkl')
+            save_run(sort_messages(df), filename, min(chunksize, MERGE_BLOCK_SIZE))
+            runs.append(filename)
+        yield from merge_runs(runs, chunksize)
+
+# save sorted messages in blocks, so they can be read back a block at a time
+def save_run(df, filename, block_size):
+    with open(filename, 'wb') as f:
+        for offset in range(0, len(df), block_size):
+            pickle.dump(df.iloc[offset:offset+block_size], f, protocol=pickle.HIGHEST_PROTOCOL)
+
+def load_run(filename):
+    with open(filename, 'rb') as f:
+        while True:
+            try:
+                yield pickle.load(f)
+            except EOFError:
+                return
+
+# the sort key, block and row number of each message in a saved run
+def get_run_rows(filename):
+    for block in load_run(filename):
+        for row, key in enumerate(get_sort_keys(block)):
+            yield key, block, row
+
+# merge the sorted runs, keeping the original order of messages that sort equally
+def merge_runs(runs, chunksize):
+    import pandas as pd
+    merged = heapq.merge(*map(get_run_rows, runs), key=lambda item: item[0])
+    while True:
+        rows = list(islice(merged, chunksize))
+        if not rows:
+            return
+        # take consecutive rows from the same block together
+        pieces = []
+        start = 0
+        for end in range(1, len(rows) + 1):
+            if end == len(rows) or rows[end][1] is not rows[start][1] or rows[end][2] != rows[end-1][2] + 1:
+                pieces.append(rows[start][1].iloc[rows[start][2]:rows[end-1][2]+1])
+                start = end
+        yield pd.concat(pieces)
+
 def main():
     parser = argparse.ArgumentParser(description='Sort data')
-    parser.add_argument('input_file', metavar='input-file', help='Input CSV file')
-    parser.add_argument('output_file', metavar='output-file', help='Output CSV file')
+    parser.add_argument('input_file', metavar='input-file', help='Input messages file (CSV, Parquet, or Feather)')
+    parser.add_argument('output_file', metavar='output-file', help='Output messages file (CSV, Parquet, or Feather)')
+    parser.add_argument('--chunksize', type=int, default=0, help='Number of messages to sort in memory at a time, merging the sorted chunks through temporary files (optional)')
+    parser.add_argument('--temp-dir', help='Directory for the temporary files (default: the system temporary directory)')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    df = load_message_data(args.input_file)
-    df = sort_messages(df)
-    save_message_data(df, args.output_file)
+    metrics = create_metrics(args, 'sort_data')
+    if args.chunksize > 0:
+        with measure(metrics, 'check'):
+            input_sorted = is_file_sorted(args.input_file, args.chunksize)
+        chunks = measure_chunks(metrics, 'load', load_message_chunks(args.input_file, args.chunksize))
+        if not input_sorted:
+            # every chunk is sorted and saved before the first sorted chunk is returned
+            chunks = measure_chunks(metrics, 'sort', sort_message_chunks(chunks, args.chunksize, temp_dir=args.temp_dir))
+        with measure(metrics, 'write') as stage:
+            save_message_chunks(stage.count(chunks), args.output_file)
+    else:
+        with measure(metrics, 'load') as stage:
+            df = load_message_data(args.input_file)
+            stage.rows += len(df)
+        with measure(metrics, 'sort') as stage:
+            df = sort_messages(df)
+            stage.rows += len(df)
+        with measure(metrics, 'write') as stage:
+            save_message_data(df, args.output_file)
+            stage.rows += len(df)
+    report_metrics(metrics, args)
 
 if __name__ == '__main__':
     # execute only if run as a script
@@ -4,41 +4,71 @@
 
 import argparse
 
+from collections import Counter
 from itertools import chain, combinations
-from names import create_counter, load_names, update_counter, write_names
+from metrics import add_metrics_arguments, create_metrics, measure, report_metrics
+from name_table import load_names_table
+from names import create_counter, write_names_stream
 
-def powerset(iterable):
+def powerset(iterable, max_size=None):
     "powerset([1,2,3]) --> () (1,) (2,) (3,) (1,2) (1,3) (2,3) (1,2,3)"
     s = list(iterable)
-    return chain.from_iterable(combinations(s, r) for r in range(len(s)+1))
+    if max_size is None:
+        max_size = len(s)
+    return chain.from_iterable(combinations(s, r) for r in range(min(max_size, len(s))+1))
 
-def find_sub_names(names):
+# all the runs of consecutive items, shortest first
+def spans(iterable, max_size=None):
+    "spans([1,2,3]) --> () (1,) (2,) (3,) (1,2) (2,3) (1,2,3)"
+    s = tuple(iterable)
+    if max_size is None:
+        max_size = len(s)
+    yield ()
+    for r in range(1, min(max_size, len(s))+1):
+        for i in range(len(s)-r+1):
+            yield s[i:i+r]
+
+# the distinct sub-names of each name, keeping the words in order
+def find_sub_names(names, *, max_parts=None, contiguous=False):
+    subsets = spans if contiguous else powerset
     for name in names:
-        for n in powerset(name.split()):
-            if n:
-                yield ' '.join(n)
+        variants = [name]
         if '-' in name:
-            name = name.replace('-', ' ')
-            for n in powerset(name.split()):
-                if n:
-                    yield ' '.join(n)
+            variants.append(name.replace('-', ' '))
+        # the same sub-name may come from both variants, but is only counted once
+        found = dict.fromkeys(' '.join(n) for variant in variants for n in subsets(variant.split(), max_parts) if n)
+        yield from found
+
+# split the names for each pseudonym in turn, sorted by pseudonym
+def split_names_stream(names, **kwargs):
+    for pseudonym in sorted(names):
+        result = Counter(find_sub_names(names[pseudonym], **kwargs))
+        if result:
+            yield pseudonym, result
 
-def split_names(names):
+def split_names(names, **kwargs):
     result = create_counter()
-    for pseudonym, candidates in names.items():
-        for name in find_sub_names(candidates):
-            update_counter(result[pseudonym], name)
+    result.update(split_names_stream(names, **kwargs))
     return result
 
 def main():
     parser = argparse.ArgumentParser(description='Split the given multi-word names into valid subsets')
     parser.add_argument('input_file', metavar='input-file', help='Text file with names for each pseudonym')
     parser.add_argument('output_file', metavar='output-file', nargs='?', help='Output text file (optional)')
+    parser.add_argument('--max-parts', type=int, default=None, help='Maximum number of words in each sub-name')
+    parser.add_argument('--contiguous', help='Only use runs of consecutive words as sub-names', action='store_true')
+    add_metrics_arguments(parser)
     args = parser.parse_args()
 
-    names = load_names(args.input_file)
-    names = split_names(names)
-    write_names(args.output_file, names)
+    metrics = create_metrics(args, 'split_names')
+    with measure(metrics, 'load') as stage:
+        names = load_names_table(args.input_file)
+        stage.rows += len(names)
+    # each pseudonym is written as soon as its names are split
+    with measure(metrics, 'split and write') as stage:
+        write_names_stream(args.output_file, split_names_stream(names, max_parts=args.max_parts, contiguous=args.contiguous))
+        stage.rows += len(names)
+    report_metrics(metrics, args)
 
 if __name__ == '__main__':
     # execute only if run as a script
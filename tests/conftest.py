@@ -0,0 +1,19 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import atexit
+import glob
+import os
+import shutil
+import sys
+import tempfile
+
+# constants.py reads config.json from the directory of the scripts, which a
+# clean checkout does not have, so the tests import a copy of the scripts
+# made with the example config
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SCRIPT_DIR = tempfile.mkdtemp(prefix='nicknames-tests-')
+atexit.register(shutil.rmtree, SCRIPT_DIR, ignore_errors=True)
+for filename in glob.glob(os.path.join(REPO_DIR, '*.py')):
+    shutil.copy(filename, SCRIPT_DIR)
+shutil.copy(os.path.join(REPO_DIR, 'examples', 'config.json'), SCRIPT_DIR)
+sys.path.insert(0, SCRIPT_DIR)
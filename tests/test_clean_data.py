@@ -0,0 +1,31 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import sys
+
+import pytest
+
+from clean_data import clean_text
+
+def test_clean_message_is_returned_unchanged():
+    text = 'Hi Ann, see you at 10:30 tomorrow.'
+    assert clean_text(text) is text
+
+@pytest.mark.parametrize('text, expected', [
+    ('"Hi Ann"', 'Hi Ann'),
+    ('He said ""ok""', 'He said "ok"'),
+    (' Hi Ann\t', 'Hi Ann'),
+    ('Hi  Ann', 'Hi Ann'),
+    ('Hi\nAnn', 'Hi Ann'),
+    ('Hi\r\nAnn', 'Hi Ann'),
+    ('Hi\xa0Ann', 'Hi Ann'),
+    ('Hi Ann', 'Hi Ann'),
+    ('', ''),
+])
+def test_clean_text(text, expected):
+    assert clean_text(text) == expected
+
+# every character that split treats as white space is cleaned, not passed through unchanged
+def test_all_white_space_is_normalised():
+    for code in range(sys.maxunicode + 1):
+        text = f'a{chr(code)}b'
+        assert clean_text(text) == ' '.join(text.split())
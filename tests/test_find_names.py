@@ -0,0 +1,47 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+from collections import Counter
+
+import pandas as pd
+
+from constants import PARENT_USER_FIELD_NAME, POST_FIELD_NAME, TEXT_FIELD_NAME, USER_FIELD_NAME
+from find_names import find_names, find_names_chunked, find_names_incremental
+from manifest import Manifest
+
+OPTIONS = {'to': True, 'from': True}
+
+def make_messages():
+    return pd.DataFrame({
+        POST_FIELD_NAME: [1, 2, 3],
+        TEXT_FIELD_NAME: ['Hi Ann, thanks. Bob', 'Hi Bob see you', 'ok Ann'],
+        USER_FIELD_NAME: ['u2', 'u1', 'u1'],
+        PARENT_USER_FIELD_NAME: ['u1', 'u2', 'u2'],
+    })
+
+def run_incremental(df, filename):
+    manifest = Manifest(filename, OPTIONS)
+    names = find_names_incremental(df, True, True, manifest)
+    manifest.close()
+    return names
+
+def test_edited_post_matches_full_run(tmp_path):
+    filename = str(tmp_path / 'manifest.db')
+    run_incremental(make_messages(), filename)
+    # edit one post and remove another, with the rows starting part way through the data
+    df = make_messages()
+    df.loc[1, TEXT_FIELD_NAME] = 'Hi Bobby see you. Ann'
+    df = df[1:]
+    assert run_incremental(df, filename) == find_names(df, True, True)
+    assert run_incremental(df, filename) == find_names(df, True, True)
+    # a change of options starts again
+    manifest = Manifest(filename, {'to': True, 'from': False})
+    assert manifest.find_posts(['2', '3']) == {}
+    manifest.close()
+
+def test_chunks_read_values_as_text(tmp_path):
+    filename = tmp_path / 'messages.csv'
+    # the second chunk has a missing pseudonym, so would be read as floating point numbers
+    filename.write_text(f'{POST_FIELD_NAME},{USER_FIELD_NAME},{PARENT_USER_FIELD_NAME},{TEXT_FIELD_NAME}\n'
+                        '1,11,12,Hi Ann\n2,12,11,Hi Bob\n3,11,,ok\n4,13,11,Hi Ann\n')
+    names = find_names_chunked(str(filename), 2, True, False)
+    assert names == {'12': Counter({'Ann': 1}), '11': Counter({'Bob': 1, 'Ann': 1})}
@@ -0,0 +1,38 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from constants import POST_FIELD_NAME, TEXT_FIELD_NAME, USER_FIELD_NAME
+from messages import load_message_data, save_message_chunks
+
+# chunks as read from a CSV file where the text is missing from every message
+# in the first chunk, and looks like a number in every message in the second
+def make_chunks():
+    yield pd.DataFrame({POST_FIELD_NAME: [0, 1, 2], TEXT_FIELD_NAME: [np.nan, np.nan, np.nan]})
+    yield pd.DataFrame({POST_FIELD_NAME: [3, 4], TEXT_FIELD_NAME: [12, 34]})
+    yield pd.DataFrame({POST_FIELD_NAME: [5, 6], TEXT_FIELD_NAME: ['Hi Ann', np.nan]})
+
+@pytest.mark.parametrize('extension', ['parquet', 'feather'])
+def test_save_chunks_with_no_text_in_first_chunk(tmp_path, extension):
+    filename = str(tmp_path / f'messages.{extension}')
+    save_message_chunks(make_chunks(), filename)
+    df = load_message_data(filename)
+    assert df[POST_FIELD_NAME].tolist() == list(range(7))
+    assert df[TEXT_FIELD_NAME].tolist() == [None, None, None, '12', '34', 'Hi Ann', None]
+
+# chunks where a column other than the text changes type from one chunk to the next
+def make_mixed_chunks():
+    yield pd.DataFrame({POST_FIELD_NAME: [0, 1], USER_FIELD_NAME: [7, 8], TEXT_FIELD_NAME: ['Hi', 'Hi']})
+    yield pd.DataFrame({POST_FIELD_NAME: [2.5, np.nan], USER_FIELD_NAME: [9, np.nan], TEXT_FIELD_NAME: ['Hi', 'Hi']})
+    yield pd.DataFrame({POST_FIELD_NAME: [4, 5], USER_FIELD_NAME: ['x', 10], TEXT_FIELD_NAME: ['Hi', 'Hi']})
+
+@pytest.mark.parametrize('extension', ['parquet', 'feather'])
+def test_save_chunks_with_column_type_changes(tmp_path, extension):
+    filename = str(tmp_path / f'messages.{extension}')
+    save_message_chunks(make_mixed_chunks(), filename)
+    df = load_message_data(filename)
+    assert df[POST_FIELD_NAME].tolist()[:3] == [0.0, 1.0, 2.5]
+    assert df[USER_FIELD_NAME].tolist() == ['7', '8', '9', None, 'x', '10']
+    assert not (tmp_path / f'messages.{extension}.tmp').exists()
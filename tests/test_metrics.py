@@ -0,0 +1,26 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import pandas as pd
+import pytest
+
+from metrics import Metrics, current_rss_mb
+
+def test_iterate_counts_only_chunks():
+    metrics = Metrics('test')
+    chunks = [pd.DataFrame({'a': range(size)}) for size in [3, 2, 4]]
+    assert list(metrics.iterate('load', chunks)) == chunks
+    stage = metrics.stages['load']
+    assert stage.calls == 3
+    assert stage.rows == 9
+
+@pytest.mark.skipif(current_rss_mb() is None, reason='the memory in use cannot be read on this system')
+def test_stage_peak_is_not_the_peak_so_far():
+    metrics = Metrics('test')
+    with metrics.stage('big'):
+        data = bytearray(200 << 20)
+        data[::4096] = b'x' * len(data[::4096])
+        del data
+    with metrics.stage('small'):
+        pass
+    # the memory used by the first stage has been released before the second
+    assert metrics.stages['small'].peak_rss_mb < metrics.stages['big'].peak_rss_mb - 100
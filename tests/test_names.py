@@ -0,0 +1,19 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import json
+
+from collections import Counter
+
+from names import load_names_csv
+
+def test_load_names_csv_counts_are_integers(tmp_path):
+    filename = tmp_path / 'students.csv'
+    filename.write_text('userid,fullname\n1,Ann Lee\n2,Bob\n1,Ann Lee\n3,\n')
+    names = load_names_csv(str(filename), 'userid', 'fullname')
+    assert names == {'1': Counter({'Ann Lee': 2}), '2': Counter({'Bob': 1}), '3': Counter({'nan': 1})}
+    assert all(type(count) is int for counter in names.values() for count in counter.values())
+    assert repr(names['1']) == "Counter({'Ann Lee': 2})"
+    json.dumps(names)
+    names = load_names_csv(str(filename), 'userid', 'fullname', divide=True, initials=False)
+    assert names == {'1': Counter({'Ann': 2, 'Lee': 2}), '2': Counter({'Bob': 1}), '3': Counter()}
+    assert all(type(count) is int for counter in names.values() for count in counter.values())
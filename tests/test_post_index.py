@@ -0,0 +1,36 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import numpy as np
+
+from post_index import PostIndex, load_post_index
+
+def test_update_skips_missing_post_ids():
+    index = PostIndex()
+    index.update(np.array(['p1', np.nan, 'p2', None], dtype=object), np.array([10, 11, 12, 13]))
+    assert len(index) == 2
+    pseudonyms, found = index.lookup(np.array(['p2', np.nan, 'p3', 'p1'], dtype=object))
+    assert pseudonyms.tolist() == [12, 10]
+    assert found.tolist() == [True, False, False, True]
+
+def test_chunks_match_single_update(tmp_path):
+    rng = np.random.default_rng(1)
+    post_ids = rng.permutation(1000)
+    pseudonyms = rng.integers(100, 200, size=1000)
+    index = PostIndex()
+    for start in range(0, 1000, 30):
+        index.update(post_ids[start:start+30], pseudonyms[start:start+30])
+    # a later pseudonym for a post replaces the earlier one
+    index.update(post_ids[:5], pseudonyms[:5] + 1000)
+    expected = pseudonyms.copy()
+    expected[:5] += 1000
+    assert len(index) == 1000
+    assert len(index.segments) > 1
+    assert index.lookup(post_ids)[0].tolist() == expected.tolist()
+
+    index.save(str(tmp_path / 'index'))
+    loaded = load_post_index(str(tmp_path / 'index'))
+    assert len(loaded.segments) == 1
+    assert loaded.lookup(post_ids)[0].tolist() == expected.tolist()
+    # changes to a loaded index are only written when it is saved
+    loaded.update(post_ids[:1], [0])
+    assert load_post_index(str(tmp_path / 'index')).lookup(post_ids[:1])[0].tolist() == expected[:1].tolist()
@@ -0,0 +1,72 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import sys
+
+from collections import Counter
+
+import pandas as pd
+
+import replace_names
+
+from constants import POST_FIELD_NAME, SESSION_FIELD_NAME, TEXT_FIELD_NAME, USER_FIELD_NAME
+from manifest import Manifest
+from replace_names import GROUP_BY_SESSION, replace_names_incremental
+
+MAPPING = {'u1': Counter(['Ann']), 'u2': Counter(['Bob']), 'u3': Counter(['Cat'])}
+OPTIONS = {'by': GROUP_BY_SESSION}
+
+def make_messages():
+    return pd.DataFrame({
+        POST_FIELD_NAME: [1, 2, 3, 4],
+        SESSION_FIELD_NAME: [10, 10, 20, 20],
+        USER_FIELD_NAME: ['u1', 'u2', 'u3', 'u1'],
+        TEXT_FIELD_NAME: ['Hi Bob', 'Thanks Ann', 'Hi Ann and Bob', 'bye Cat'],
+    })
+
+def run_incremental(df, filename, capsys):
+    manifest = Manifest(filename, OPTIONS)
+    counts = replace_names_incremental(df, MAPPING, manifest, group_by=GROUP_BY_SESSION, verbose=True)
+    manifest.close()
+    return counts, capsys.readouterr().err
+
+def test_edited_post_matches_full_run(tmp_path, capsys):
+    filename = str(tmp_path / 'manifest.db')
+    run_incremental(make_messages(), filename, capsys)
+    df = make_messages()
+    # edit one post, and add one by a user new to its session
+    df.loc[0, TEXT_FIELD_NAME] = 'Hi Bob and Cat'
+    df.loc[4] = [5, 20, 'u2', 'Hi Cat']
+    expected = df.copy()
+    expected_counts = replace_names.replace_names(expected, MAPPING, group_by=GROUP_BY_SESSION)
+    output = df.copy()
+    counts, log = run_incremental(output, filename, capsys)
+    assert output[TEXT_FIELD_NAME].tolist() == expected[TEXT_FIELD_NAME].tolist()
+    assert counts == expected_counts
+    # the edited post and the whole of the changed session
+    assert 'replaced names in 4 new or changed posts out of 5' in log
+    # a run with no changes reuses every post
+    output = df.copy()
+    counts, log = run_incremental(output, filename, capsys)
+    assert output[TEXT_FIELD_NAME].tolist() == expected[TEXT_FIELD_NAME].tolist()
+    assert counts == expected_counts
+    assert 'replaced names in 0 new or changed posts out of 5' in log
+
+def test_duplicate_post_ids_process_all_posts(tmp_path, monkeypatch, capsys):
+    df = make_messages()
+    df.loc[1, POST_FIELD_NAME] = 1
+    df.to_csv(tmp_path / 'messages.csv', index=False)
+    (tmp_path / 'names.txt').write_text('u1|Ann\nu2|Bob\nu3|Cat\n')
+    for output, extra in [('full.csv', []), ('incremental.csv', ['--manifest', str(tmp_path / 'manifest.db')])]:
+        monkeypatch.setattr(sys, 'argv', ['replace_names.py', str(tmp_path / 'messages.csv'), str(tmp_path / 'names.txt'), str(tmp_path / output), *extra])
+        replace_names.main()
+    assert 'post IDs' in capsys.readouterr().err
+    assert (tmp_path / 'incremental.csv').read_text() == (tmp_path / 'full.csv').read_text()
+
+def test_chunks_are_written_as_read(tmp_path, monkeypatch):
+    # the second chunk has a missing session, so would be read as floating point numbers
+    header = f'{POST_FIELD_NAME},{SESSION_FIELD_NAME},{USER_FIELD_NAME},{TEXT_FIELD_NAME}\n'
+    (tmp_path / 'messages.csv').write_text(header + '1,10,u1,Hi Bob\n2,10,u2,Thanks Ann\n3,,u3,Hi Ann\n4,20,u1,bye Cat\n')
+    (tmp_path / 'names.txt').write_text('u1|Ann\nu2|Bob\nu3|Cat\n')
+    monkeypatch.setattr(sys, 'argv', ['replace_names.py', str(tmp_path / 'messages.csv'), str(tmp_path / 'names.txt'), str(tmp_path / 'output.csv'), '--by', 'none', '--chunksize', '2'])
+    replace_names.main()
+    assert (tmp_path / 'output.csv').read_text() == header + '1,10,u1,Hi u2\n2,10,u2,Thanks u1\n3,,u3,Hi u1\n4,20,u1,bye u3\n'
@@ -0,0 +1,150 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import re
+
+from types import SimpleNamespace
+
+import pytest
+
+from textwash_wrapper import Washer
+
+UNK_TOKEN = '[UNK]'
+UNK_TOKEN_ID = 0
+# the model reads at most this many tokens at once, including the two special tokens
+MAX_TOKENS = 8
+
+# the label the stand-in model gives to the first sub-token of each word
+LABELS = {
+    'Jo': 'PERSON_FIRSTNAME', 'Ann': 'PERSON_FIRSTNAME', UNK_TOKEN: 'PERSON_FIRSTNAME', 'Smith': 'PERSON_LASTNAME',
+    'J': 'PERSON_INITIALS', '.': 'PERSON_INITIALS', 'Bob': 'B-PERSON', 'Lee': 'I-PERSON', 'Kim': 'B-PERSON',
+    'Edinburgh': 'LOCATION',
+}
+
+WORD_PATTERN = re.compile(r'\w+|[^\w\s]')
+
+TEXTS = [
+    'Hi Jo Ann Smith, see you in Edinburgh.',
+    'Thanks J. Smith and Édith Ann',
+    'no names here',
+    '',
+    'word ' * 20 + 'Bob Lee Kim went to Edinburgh with Ann Smith',
+    'Edinburgh ' * 10,
+]
+
+# A stand-in for the fast tokenizer: words are split into sub-tokens of up to
+# three characters, and words that are not ASCII are unknown
+class FakeTokenizer:
+
+    model_max_length = MAX_TOKENS
+    unk_token_id = UNK_TOKEN_ID
+
+    def __init__(self):
+        # the id of each sub-token, and whether it starts a word
+        self.vocab = {}
+        self.tokens = {UNK_TOKEN_ID: (UNK_TOKEN, True)}
+
+    def num_special_tokens_to_add(self):
+        return 2
+
+    def get_id(self, piece, first):
+        if (piece, first) not in self.vocab:
+            self.vocab[(piece, first)] = len(self.tokens)
+            self.tokens[len(self.tokens)] = (piece, first)
+        return self.vocab[(piece, first)]
+
+    def __call__(self, texts, add_special_tokens, return_offsets_mapping):
+        assert not add_special_tokens and return_offsets_mapping
+        encoded = {'input_ids': [], 'offset_mapping': [], 'word_ids': []}
+        for text in texts:
+            ids, offsets, word_ids = [], [], []
+            for word_id, match in enumerate(WORD_PATTERN.finditer(text)):
+                if not match.group().isascii():
+                    pieces = [(match.start(), match.end())]
+                else:
+                    pieces = [(start, min(start + 3, match.end())) for start in range(match.start(), match.end(), 3)]
+                for idx, (start, end) in enumerate(pieces):
+                    # the label of a word depends on the whole word, so sub-tokens are not shared between words
+                    piece = text[start:end] if idx else match.group()
+                    ids.append(UNK_TOKEN_ID if not match.group().isascii() else self.get_id(piece, idx == 0))
+                    offsets.append((start, end))
+                    word_ids.append(word_id)
+            encoded['input_ids'].append(ids)
+            encoded['offset_mapping'].append(offsets)
+            encoded['word_ids'].append(word_ids)
+        return FakeEncoding(encoded)
+
+class FakeEncoding(dict):
+
+    def word_ids(self, idx):
+        return self['word_ids'][idx]
+
+# A stand-in for the model, labelling each token without using its context
+class FakeModel:
+
+    def __init__(self, tokenizer):
+        self.tokenizer = tokenizer
+        self.batches = []
+
+    def predict(self, windows):
+        self.batches.append(len(windows))
+        result = []
+        for ids in windows:
+            assert len(ids) <= MAX_TOKENS - 2
+            labels = []
+            for token_id in ids:
+                piece, first = self.tokenizer.tokens[token_id]
+                labels.append(LABELS.get(piece, 'NONE') if first else 'NONE')
+            result.append(labels)
+        return result
+
+# A stand-in for the Textwash anonymiser, which labels each word of a message
+# and joins neighbouring words with the same label, separated by spaces
+class FakeAnonymiser:
+
+    def get_identifiable_tokens(self, text):
+        entities = []
+        previous = None
+        for match in WORD_PATTERN.finditer(text):
+            string = match.group() if match.group().isascii() else UNK_TOKEN
+            label = LABELS.get(string, 'NONE')
+            if label == 'NONE':
+                previous = None
+                continue
+            entity_label = label[2:] if label[:2] in ('B-', 'I-') else label
+            if entity_label == previous and not label.startswith('B-'):
+                entities[-1][0].append(string)
+            else:
+                entities.append(([string], entity_label))
+            previous = entity_label
+        return [(' '.join(strings), label) for strings, label in entities]
+
+@pytest.fixture
+def washer():
+    washer = Washer.__new__(Washer)
+    washer.config = SimpleNamespace(unk_token=UNK_TOKEN)
+    washer.tokenizer = FakeTokenizer()
+    washer.model = FakeModel(washer.tokenizer)
+    washer.predict = washer.model.predict
+    washer.anonymiser = FakeAnonymiser()
+    washer.cache = None
+    washer.batch_size = 1
+    return washer
+
+def test_batched_tokens_match_single_messages(washer):
+    single = [washer.identify_tokens(text) for text in TEXTS]
+    washer.batch_size = 4
+    batched = washer.identify_tokens_batch(TEXTS)
+    assert batched == single
+    assert batched[0] == {'Jo Ann': 'PERSON_FIRSTNAME', 'Smith': 'PERSON_LASTNAME', 'Edinburgh': 'LOCATION'}
+    # a name that includes an unknown word is not found in the text
+    assert batched[1] == {'J': 'PERSON_INITIALS', 'Smith': 'PERSON_LASTNAME'}
+    assert batched[4] == {'Bob Lee': 'PERSON', 'Kim': 'PERSON', 'Edinburgh': 'LOCATION', 'Ann': 'PERSON_FIRSTNAME', 'Smith': 'PERSON_LASTNAME'}
+    # the long messages were split into windows, four at a time
+    assert max(washer.model.batches) == 4
+    assert len(washer.model.batches) > 2
+
+def test_batched_names_match_single_messages(washer):
+    data = [([str(idx)], text) for idx, text in enumerate(TEXTS)]
+    single = washer.find_names(data)
+    washer.batch_size = 3
+    assert washer.find_names(data) == single
@@ -0,0 +1,48 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import multiprocessing
+import time
+
+import token_cache
+
+from token_cache import TokenCache
+
+# add entries slowly, as a worker does while it runs the model
+def add_entries(filename, prefix, count):
+    cache = TokenCache(filename, 'model')
+    for idx in range(count):
+        cache.put(f'{prefix}{idx}', [[f'{prefix}{idx}', 'PERSON_FIRSTNAME']])
+        time.sleep(0.01)
+        if idx % 10 == 9:
+            cache.commit()
+    cache.close()
+
+def test_processes_share_cache_file(tmp_path, monkeypatch):
+    filename = str(tmp_path / 'cache.db')
+    # give up sooner than a run would, so a held lock fails the test quickly
+    monkeypatch.setattr(token_cache, 'LOCK_TIMEOUT', 0.5)
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=add_entries, args=(filename, prefix, 50)) for prefix in ['a', 'b']]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert [process.exitcode for process in processes] == [0, 0]
+    cache = TokenCache(filename, 'model')
+    for prefix in ['a', 'b']:
+        for idx in range(50):
+            assert cache.get(f'{prefix}{idx}') == [[f'{prefix}{idx}', 'PERSON_FIRSTNAME']]
+    assert cache.pop_stats() == (100, 0)
+    cache.close()
+
+def test_new_entries_are_found_before_they_are_written(tmp_path):
+    cache = TokenCache(str(tmp_path / 'cache.db'), 'model')
+    cache.put('Hi Ann', [['Ann', 'PERSON_FIRSTNAME']])
+    assert cache.pending
+    assert cache.get('Hi Ann') == [['Ann', 'PERSON_FIRSTNAME']]
+    assert cache.get('Hi Bob') is None
+    cache.close()
+    cache = TokenCache(str(tmp_path / 'cache.db'), 'model')
+    assert cache.get('Hi Ann') == [['Ann', 'PERSON_FIRSTNAME']]
+    assert TokenCache(str(tmp_path / 'cache.db'), 'other model').get('Hi Ann') is None
+    cache.close()
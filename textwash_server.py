@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+# A long-running local server that loads the Textwash model once and answers
+# requests over a Unix socket, so that each run of find_names.py can start at
+# once. Requests and responses are single lines of JSON:
+#   {"method": "find_names", "data": [[labels, text], ...]}
+#   {"method": "wash", "data": {key: text, ...}}
+#   {"method": "info"}
+
+import argparse
+import json
+import os
+import socket
+import socketserver
+import stat
+import sys
+import tempfile
+
+from names import create_counter
+
+SOCKET_NAME = 'nicknames-textwash.sock'
+
+# the private directory for the socket: the user's runtime directory, or
+# a directory in the temp directory that only the user can use
+def get_socket_dir():
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR')
+    if runtime_dir:
+        return runtime_dir
+    return os.path.join(tempfile.gettempdir(), f'nicknames-textwash-{os.getuid()}')
+
+# the socket used when none is given, shared by the server and its clients
+def get_default_socket():
+    return os.environ.get('TEXTWASH_SOCKET') or os.path.join(get_socket_dir(), SOCKET_NAME)
+
+# make sure that only this user can reach the socket: the messages sent to
+# the server are private, so a socket or directory set up by another user
+# must never be used
+def check_owner(path, *, is_socket):
+    info = os.lstat(path)
+    kind = 'socket' if is_socket else 'directory'
+    if is_socket and not stat.S_ISSOCK(info.st_mode):
+        raise PermissionError(f'{path} is not a socket')
+    if not is_socket and not stat.S_ISDIR(info.st_mode):
+        raise PermissionError(f'{path} is not a directory')
+    if info.st_uid != os.getuid():
+        raise PermissionError(f'the {kind} {path} belongs to another user')
+    if info.st_mode & (stat.S_IRWXG | stat.S_IRWXO):
+        raise PermissionError(f'the {kind} {path} can be used by other users (mode {stat.S_IMODE(info.st_mode):o})')
+
+# create the directory for the socket if needed, readable only by this user
+def make_socket_dir(path):
+    directory = os.path.dirname(os.path.abspath(path))
+    if not os.path.exists(directory):
+        os.makedirs(directory, mode=0o700)
+    check_owner(directory, is_socket=False)
+
+# Handle the requests from one client connection, one line at a time
+class WasherRequestHandler(socketserver.StreamRequestHandler):
+
+    def handle(self):
+        for line in self.rfile:
+            try:
+                response = self.server.handle_request_data(json.loads(line))
+            except Exception as e:
+                response = {'error': f'{type(e).__name__}: {e}'}
+            self.wfile.write(json.dumps(response).encode('utf-8') + b'\n')
+            self.wfile.flush()
+
+# Serve requests using a single Washer; requests are handled one at a time
+class WasherServer(socketserver.UnixStreamServer):
+
+    def __init__(self, path, washer):
+        self.washer = washer
+        # create the socket with no access for other users
+        umask = os.umask(0o177)
+        try:
+            super().__init__(path, WasherRequestHandler)
+        finally:
+            os.umask(umask)
+
+    def handle_request_data(self, request):
+        method = request.get('method')
+        if method == 'find_names':
+            names = self.washer.find_names(request['data'])
+            stats = None if self.washer.cache is None else self.washer.cache.pop_stats()
+            # keep the type of each label, which JSON keys would lose
+            return {'names': [[label, counts] for label, counts in names.items()], 'stats': stats}
+        if method == 'wash':
+            return {'outputs': self.washer.wash(request['data'])}
+        if method == 'info':
+            return {'model': self.washer.get_model_id(), 'batch_size': self.washer.batch_size, 'cache': self.washer.cache is not None}
+        raise ValueError(f'unknown method: {method}')
+
+# A client for a running server, with find_names and wash methods like those of a Washer
+class WasherClient:
+
+    def __init__(self, sock, path):
+        self.path = path
+        self.sock = sock
+        self.rfile = sock.makefile('rb')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+    def send_request(self, method, data=None):
+        request = {'method': method}
+        if data is not None:
+            request['data'] = data
+        self.sock.sendall(json.dumps(request).encode('utf-8') + b'\n')
+        line = self.rfile.readline()
+        if not line:
+            raise RuntimeError(f'Textwash server at {self.path} closed the connection')
+        response = json.loads(line)
+        if 'error' in response:
+            raise RuntimeError(f'Textwash server error: {response["error"]}')
+        return response
+
+    # return the names found and the cache statistics, or None if there is no cache
+    def find_names(self, data_generator):
+        response = self.send_request('find_names', [[labels, text] for labels, text in data_generator])
+        result = create_counter()
+        for label, counts in response['names']:
+            result[label].update(counts)
+        return result, response['stats']
+
+    def wash(self, data):
+        return self.send_request('wash', data)['outputs']
+
+    def info(self):
+        return self.send_request('info')
+
+# connect to the server if it is running, otherwise return None;
+# raises PermissionError if the socket could belong to another user
+def connect_washer(path):
+    if not os.path.exists(path):
+        return None
+    check_owner(os.path.dirname(os.path.abspath(path)), is_socket=False)
+    check_owner(path, is_socket=True)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+    except (ConnectionRefusedError, FileNotFoundError):
+        sock.close()
+        return None
+    return WasherClient(sock, path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Load the Textwash model once and serve requests from find_names.py')
+    parser.add_argument('--socket', default=get_default_socket(), help='Unix socket to listen on (default: %(default)s)')
+    parser.add_argument('--batch-size', type=int, default=1, help='Number of messages to pass to the model at once, above 1 only with --experimental-batching')
+    parser.add_argument('--experimental-batching', help='Allow a batch size above 1, which finds names without the Textwash anonymiser', action='store_true')
+    parser.add_argument('--threads', type=int, default=None, help='Number of threads for model inference')
+    parser.add_argument('--cache', help='File for caching the tokens found in each message')
+    args = parser.parse_args()
+
+    if args.batch_size > 1 and not args.experimental_batching:
+        parser.error('--batch-size above 1 is experimental; add --experimental-batching to use it')
+    try:
+        make_socket_dir(args.socket)
+        client = connect_washer(args.socket)
+    except PermissionError as e:
+        sys.exit(f'ERROR: {e}')
+    if client is not None:
+        client.close()
+        sys.exit(f'ERROR: a Textwash server is already running at {args.socket}')
+    if os.path.exists(args.socket):
+        # left behind by a server that did not shut down cleanly
+        os.remove(args.socket)
+
+    from textwash_wrapper import Washer
+    washer = Washer(batch_size=args.batch_size, threads=args.threads, cache_file=args.cache)
+    with WasherServer(args.socket, washer) as server:
+        print(f'INFO: Textwash server listening on {args.socket}', file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            os.remove(args.socket)
+            if washer.cache is not None:
+                washer.cache.close()
+
+if __name__ == '__main__':
+    # execute only if run as a script
+    main()
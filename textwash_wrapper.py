@@ -4,25 +4,36 @@
 # at https://github.com/maximilianmozes/textwash
 
 import os
-import re
 import sys
-import torch
 
 from collections import defaultdict, Counter
+from itertools import islice
+
+from name_matcher import NameMatcher
+from token_cache import TokenCache
+
+# torch and the Textwash code are only imported when the model is loaded
 
 TEXTWASH_DIR = os.environ.get('TEXTWASH_DIR')
-sys.path.insert(0, TEXTWASH_DIR)
 
-from config import Config
-from data_processor import DataProcessor
-from bert_model import BERTModel
-from anonymiser import Anonymiser
-from utils import load_model
+# the labels of words that are not part of any entity
+OUTSIDE_LABELS = {'O', 'NONE'}
 
 # A wrapper around Textwash functionality
 class Washer:
 
-    def __init__(self):
+    def __init__(self, *, batch_size=1, threads=None, cache_file=None):
+        import torch
+        sys.path.insert(0, TEXTWASH_DIR)
+        from config import Config
+        from data_processor import DataProcessor
+        from bert_model import BERTModel
+        from anonymiser import Anonymiser
+        from utils import load_model
+
+        if threads:
+            torch.set_num_threads(threads)
+        self.batch_size = batch_size
         oldwd = os.getcwd()
         os.chdir(TEXTWASH_DIR)
         config = Config()
@@ -33,10 +44,29 @@ class Washer:
         bert_model = BERTModel(config)
         model = load_model(config.load_model_path, bert_model.model)
         self.config = config
+        self.model = model
+        self.tokenizer = bert_model.tokenizer
+        if batch_size > 1:
+            # batching reads word offsets from a fast tokenizer and label names from the data processor
+            if not getattr(self.tokenizer, 'is_fast', False) or not hasattr(data_processor, 'label_map'):
+                sys.exit('ERROR: this Textwash model cannot be used with a batch size above 1')
+            # map label ids back to names such as PERSON_FIRSTNAME
+            self.id2label = {idx: label for label, idx in data_processor.label_map.items()}
         self.anonymiser = Anonymiser(config, model, data_processor, device, bert_model)
+        self.cache = None
+        if cache_file:
+            self.cache = TokenCache(cache_file, self.get_model_id())
         os.chdir(oldwd)
 
-    # Use the Textwash anonymiser directly to anonymise the text
+    # identify the model file and the way it is run, so cached tokens are only reused for the same model
+    def get_model_id(self):
+        path = os.path.realpath(self.config.load_model_path)
+        stat = os.stat(path)
+        mode = 'batched' if self.batch_size > 1 else 'single'
+        return f'{path}:{stat.st_size}:{stat.st_mtime_ns}:{mode}'
+
+    # Use the Textwash anonymiser directly to anonymise the text; batching
+    # only applies to finding names, so the output is the same for any batch size
     def wash(self, data):
         outputs = {}
         for idx, (k, text) in enumerate(data.items()):
@@ -49,20 +79,37 @@ class Washer:
     # Use the Textwash BERT model to find names in the data
     def find_names(self, data_generator):
         result = defaultdict(Counter)
-        for labels, text in data_generator:
-            names = self.find_name_tokens(text)
+        for labels, names in self.find_names_per_message(data_generator):
             if isinstance(labels, int) or isinstance(labels, str):
                 labels = [labels]
             for label in labels:
                 result[label].update(names)
+        if self.cache is not None:
+            self.cache.commit()
         return result
 
+    # find the names in each message, in batches if the batch size allows
+    def find_names_per_message(self, data_generator):
+        if self.batch_size <= 1:
+            for labels, text in data_generator:
+                yield labels, self.find_name_tokens(text)
+            return
+        data_generator = iter(data_generator)
+        while True:
+            batch = list(islice(data_generator, self.batch_size))
+            if not batch:
+                return
+            labels, texts = zip(*batch)
+            yield from zip(labels, self.find_name_tokens_batch(texts))
+
     # Replace all names found by the Textwash BERT model
     def replace_names(self, data):
         repl_map = self.make_replacement_map(self.find_names(data.items()))
+        # compile the names once, for a single pass over each message
+        matcher = self.make_matcher(repl_map)
         outputs = {}
         for idx, (k, text) in enumerate(data.items()):
-            anonymised = self.anonymise(text, repl_map)
+            anonymised = self.anonymise(text, matcher)
             outputs[k] = {'orig': text, 'anon': anonymised}
 
             print(f'Anonymised {idx+1}/{len(data)}')
@@ -73,39 +120,145 @@ class Washer:
         names = set([k for k, v in tokens.items() if v.startswith('PERSON')])
         return names
 
+    # find the names in each message of a batch
+    def find_name_tokens_batch(self, texts):
+        for tokens in self.get_tokens_batch(texts):
+            yield set([k for k, v in tokens.items() if v.startswith('PERSON')])
+
+    # find the tokens in a batch of messages, only running the model for messages not in the cache
+    def get_tokens_batch(self, texts):
+        if self.cache is None:
+            return self.identify_tokens_batch(texts)
+        result = [self.cache.get(text) for text in texts]
+        missing = [idx for idx, tokens in enumerate(result) if tokens is None]
+        if missing:
+            found = self.identify_tokens_batch([texts[idx] for idx in missing])
+            for idx, tokens in zip(missing, found):
+                self.cache.put(texts[idx], tokens)
+                result[idx] = tokens
+            self.cache.commit()
+        return result
+
+    # find the entities in a batch of messages, labelling each word from its first
+    # sub-token and splitting long messages into windows the model can read
+    def identify_tokens_batch(self, texts):
+        encoded = self.tokenizer(list(texts), add_special_tokens=False, return_offsets_mapping=True)
+        words = [self.get_words(encoded, idx) for idx in range(len(texts))]
+        windows = [window for message_words in words for window in self.split_words(message_words)]
+        for offset in range(0, len(windows), self.batch_size):
+            batch = windows[offset:offset+self.batch_size]
+            predictions = self.predict([[token_id for word in window for token_id in word['ids']] for window in batch])
+            for window, labels in zip(batch, predictions):
+                position = 0
+                for word in window:
+                    word['label'] = labels[position]
+                    position += len(word['ids'])
+        return [self.get_entities(text, message_words) for text, message_words in zip(texts, words)]
+
+    # the words of one encoded message, as spans of the text with their token ids
+    def get_words(self, encoded, idx):
+        words = []
+        previous = None
+        for word_id, token_id, (start, end) in zip(encoded.word_ids(idx), encoded['input_ids'][idx], encoded['offset_mapping'][idx]):
+            if word_id is None:
+                continue
+            if word_id == previous:
+                words[-1]['end'] = end
+                words[-1]['ids'].append(token_id)
+            else:
+                words.append({'start': start, 'end': end, 'ids': [token_id], 'label': None})
+            previous = word_id
+        return words
+
+    # split the words of a message into windows of at most as many tokens as the model can read
+    def split_words(self, words):
+        size = self.tokenizer.model_max_length - self.tokenizer.num_special_tokens_to_add()
+        window, length = [], 0
+        for word in words:
+            # a word too long for a window is labelled from its first sub-tokens
+            word['ids'] = word['ids'][:size]
+            if window and length + len(word['ids']) > size:
+                yield window
+                window, length = [], 0
+            window.append(word)
+            length += len(word['ids'])
+        if window:
+            yield window
+
+    # run the model once over a padded batch of windows, returning the label of each token
+    def predict(self, windows):
+        import torch
+        inputs = [self.tokenizer.build_inputs_with_special_tokens(ids) for ids in windows]
+        encoded = self.tokenizer.pad({'input_ids': inputs}, return_tensors='pt')
+        with torch.inference_mode():
+            logits = self.model(**encoded)[0]
+        predictions = logits.argmax(dim=-1).tolist()
+        # skip the special token at the start of each window
+        return [[self.id2label[label_id] for label_id in row[1:len(ids)+1]] for row, ids in zip(predictions, windows)]
+
+    # join neighbouring words with the same label into entities, as the Textwash anonymiser
+    # does for a single message, and normalise them in the same way
+    def get_entities(self, text, words):
+        entities = []
+        previous = None
+        for word in words:
+            label = word['label']
+            if label in OUTSIDE_LABELS:
+                previous = None
+                continue
+            entity_label = label[2:] if label[:2] in ('B-', 'I-') else label
+            # words the tokenizer does not know are returned as the unknown token
+            if all(token_id == self.tokenizer.unk_token_id for token_id in word['ids']):
+                string = self.config.unk_token
+            else:
+                string = text[word['start']:word['end']]
+            if entity_label == previous and not label.startswith('B-'):
+                entities[-1][0].append(string)
+            else:
+                entities.append(([string], entity_label))
+            previous = entity_label
+        return {token: label for strings, label in entities for token in self.normalise_token(' '.join(strings), text)}
+
+    # find the tokens in a message, using the cache if there is one
     def get_tokens(self, text):
-        def get_normalised_tokens(string):
-            if string == self.config.unk_token:
-                return
-            if len(string) == 1 and not string.isalnum():
-                return
-            if string.startswith('.'):
-                string = string[1:].strip()
-            if string.endswith('.'):
-                string = string[:-1].strip()
-            for s in reformat_periods(string):
-                if s in text:
-                    yield s
-
-        # selectively remove spacing before token-internal periods
-        def reformat_periods(string, start=0):
-            yield string
-            for i in range(start, len(string)-1):
-                if string[i:i+2] == ' .':
-                    for p in reformat_periods(string[:i] + string[i+1:], i+1):
-                        yield p
+        if self.cache is None:
+            return self.identify_tokens(text)
+        tokens = self.cache.get(text)
+        if tokens is None:
+            tokens = self.identify_tokens(text)
+            self.cache.put(text, tokens)
+        return tokens
 
+    def identify_tokens(self, text):
         entity_list = self.anonymiser.get_identifiable_tokens(text)
-        result = {token: v for k, v in entity_list for token in get_normalised_tokens(k)}
+        result = {token: v for k, v in entity_list for token in self.normalise_token(k, text)}
         return result
 
+    # the forms of a token found in the text, without the unknown token,
+    # lone punctuation, or periods at either end
+    def normalise_token(self, string, text):
+        if string == self.config.unk_token:
+            return
+        if len(string) == 1 and not string.isalnum():
+            return
+        if string.startswith('.'):
+            string = string[1:].strip()
+        if string.endswith('.'):
+            string = string[:-1].strip()
+        for s in reformat_periods(string):
+            if s in text:
+                yield s
+
+    # replace all the tokens in one pass, longest first
     def anonymise(self, text, repl_map):
-        # run through all the substitutions cumulatively
-        for token, repl in repl_map.items():
-            pattern = r'\b{}(\b|$)'.format(re.escape(token))
-            text = re.sub(pattern, repl, text)
+        matcher = repl_map if isinstance(repl_map, NameMatcher) else self.make_matcher(repl_map)
+        text, _ = matcher.substitute(text)
         return text
 
+    def make_matcher(self, repl_map):
+        # tokens may also end with punctuation at the end of the text
+        return NameMatcher(repl_map, end=r'(?:\b|$)')
+
     # make one combined map from tokens to replacements
     def make_replacement_map(self, token_map):
         repl_map = {}
@@ -114,9 +267,18 @@ class Washer:
             for tok in token_map[key]:
                 repl_map[tok] = replacement
         # sort the keys so we handle multi-word strings correctly
-        result = {key: repl_map[key] for key in sort_names(repl_map)}
+        result = {key: repl_map[key] for key in self.sort_names(repl_map)}
         return result
 
+    @staticmethod
     def sort_names(names):
         # sort by length (longest first) then alphabetically
         return sorted(list(names), key=lambda x: (-len(x), x))
+
+# selectively remove spacing before token-internal periods
+def reformat_periods(string, start=0):
+    yield string
+    for i in range(start, len(string)-1):
+        if string[i:i+2] == ' .':
+            for p in reformat_periods(string[:i] + string[i+1:], i+1):
+                yield p
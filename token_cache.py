@@ -0,0 +1,72 @@
+# © All rights reserved. Elaine Farrow, University of Edinburgh, United Kingdom, 2022
+
+import hashlib
+import json
+import sqlite3
+
+# seconds to wait for another process writing to the same file
+LOCK_TIMEOUT = 60
+# number of new entries to hold in memory before writing them to the file
+WRITE_SIZE = 256
+
+# A persistent cache of the tokens found in each message, stored in SQLite
+# and keyed by a hash of the message text and the model that found them.
+# New entries are written in one short transaction, so that worker processes
+# sharing the file never hold the write lock while running the model.
+class TokenCache:
+
+    def __init__(self, filename, model_id):
+        self.model_id = model_id
+        self.hits = 0
+        self.misses = 0
+        # the entries not yet written, by key
+        self.pending = {}
+        self.connection = sqlite3.connect(filename, timeout=LOCK_TIMEOUT)
+        # readers and the writer do not block each other
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS tokens (key TEXT PRIMARY KEY, tokens TEXT)')
+        self.connection.commit()
+
+    def make_key(self, text):
+        data = f'{self.model_id}\0{text}'.encode('utf-8')
+        return hashlib.sha256(data).hexdigest()
+
+    # return the cached tokens for this text, or None if there are none
+    def get(self, text):
+        key = self.make_key(text)
+        data = self.pending.get(key)
+        if data is None:
+            row = self.connection.execute('SELECT tokens FROM tokens WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            data = row[0]
+        self.hits += 1
+        return json.loads(data)
+
+    def put(self, text, tokens):
+        self.pending[self.make_key(text)] = json.dumps(tokens)
+        if len(self.pending) >= WRITE_SIZE:
+            self.commit()
+
+    # write the new entries to the file
+    def commit(self):
+        if not self.pending:
+            return
+        with self.connection:
+            self.connection.executemany('INSERT OR REPLACE INTO tokens VALUES (?, ?)', self.pending.items())
+        self.pending.clear()
+
+    def close(self):
+        self.commit()
+        self.connection.close()
+
+    # return the hit and miss counts since the last call
+    def pop_stats(self):
+        stats = self.hits, self.misses
+        self.hits = 0
+        self.misses = 0
+        return stats
+
+def format_cache_stats(hits, misses):
+    return f'INFO: token cache hits: {hits}, misses: {misses}'